@@ -1,8 +1,14 @@
 import aioble
+from aioble.core import register_irq_handler
 import bluetooth
+from micropython import const
 import uasyncio as aio
+import struct
 from drivers.pcf85063a import set_external_rtc
 import enums
+from library import schedule
+from library.clock import clock
+from library.state import state
 
 from library.logger import Log
 log = Log(__name__, Log.INFO).get_logger()
@@ -20,25 +26,190 @@ log = Log(__name__, Log.INFO).get_logger()
 """
 
 # Davey AP Services UUID
-_lights_Service_UUID = bluetooth.UUID(0xDA10)
-_heat_Service_UUID = bluetooth.UUID(0xDA20)
-_wf_Service_UUID = bluetooth.UUID(0xDA30)
-_gl_Service_UUID = bluetooth.UUID(0xDA40)
-_config_Service_UUID = bluetooth.UUID(0xDA50)
-_spa_refill_Service_UUID = bluetooth.UUID(0xDA60)
-_status_Service_UUID = bluetooth.UUID(0xDA70)
+_lights_Service_UUID = const(0xDA10)
+_heat_Service_UUID = const(0xDA20)
+_wf_Service_UUID = const(0xDA30)
+_gl_Service_UUID = const(0xDA40)
+_config_Service_UUID = const(0xDA50)
+_spa_refill_Service_UUID = const(0xDA60)
+_status_Service_UUID = const(0xDA70)
 
 # Davey AP Characteristics UUID
-_SCHEDULE_1_Char_UUID = bluetooth.UUID(0xFFA1)
-_SCHEDULE_2_Char_UUID = bluetooth.UUID(0xFFA2)
-_MANUAL_CONFIG_Char_UUID = bluetooth.UUID(0xFFA3)
-_MODE_Char_UUID = bluetooth.UUID(0xFFA4)
-_STATUS_Char_UUID = bluetooth.UUID(0xFFA5)
+_SCHEDULE_1_Char_UUID = const(0xFFA1)
+_SCHEDULE_2_Char_UUID = const(0xFFA2)
+_MANUAL_CONFIG_Char_UUID = const(0xFFA3)
+_MODE_Char_UUID = const(0xFFA4)
+_STATUS_Char_UUID = const(0xFFA5)
 
-_LIGHTS_BRAND_UUID = bluetooth.UUID(0xFFB1)
-_TIME_SYNC_UUID = bluetooth.UUID(0xFFB2)
+_LIGHTS_BRAND_UUID = const(0xFFB1)
+_TIME_SYNC_UUID = const(0xFFB2)
+_COMMAND_UUID = const(0xFFB3)
 
-_WATER_TEMPERATURE_UUID = bluetooth.UUID(0xFFC1)
+_WATER_TEMPERATURE_UUID = const(0xFFC1)
+_SYSTEM_STATUS_UUID = const(0xFFC2)
+
+WATER_TEMPERATURE_UNKNOWN = const(-32768)
+
+# Characteristic flags
+_R = const(0x01)  # read
+_W = const(0x02)  # write
+_N = const(0x04)  # notify
+_WNR = const(0x08)  # write without response
+
+
+class Codec:
+    '''
+    Value types used by BLEManager.get() and BLEManager.set()
+    '''
+    RAW = const(0)  # bytes as is
+    U8 = const(1)  # single byte <-> int
+    STR = const(2)  # ascii <-> str
+    SCHEDULE = const(3)  # library.schedule binary format <-> tuple
+    I16 = const(4)  # signed 16 bit little endian <-> int
+
+
+# GATT Schema
+# Services: attribute prefix, UUID (registration and advertising order)
+_SERVICES = (
+    ("lights", _lights_Service_UUID),
+    ("wf", _wf_Service_UUID),
+    ("heat", _heat_Service_UUID),
+    ("gl", _gl_Service_UUID),
+    ("spa_refill", _spa_refill_Service_UUID),
+    ("config", _config_Service_UUID),
+    ("status", _status_Service_UUID),
+)
+
+# Characteristics: service prefix, name, UUID, flags, default value, codec
+# BLEManager exposes each one as <name>_char
+_SCHEMA = (
+    # Lights
+    # 18000/60/60, 25200 -> 5am, 7am
+    ("lights", "lights_schedule1", _SCHEDULE_1_Char_UUID, _R | _W,
+     schedule.pack(18000, 25200, 127, 0, 5), Codec.SCHEDULE),
+    ("lights", "lights_schedule2", _SCHEDULE_2_Char_UUID, _R | _W,
+     schedule.pack(64800, 72000, 127, 0, 7), Codec.SCHEDULE),
+    ("lights", "lights_manual_config", _MANUAL_CONFIG_Char_UUID, _R | _W | _N,
+     bytes([enums.Light.ColourCode.Yellow]), Codec.U8),
+    ("lights", "lights_mode", _MODE_Char_UUID, _R | _W,
+     enums.Modes.ManualOff, Codec.RAW),
+    ("lights", "lights_status", _STATUS_Char_UUID, _R | _N,
+     enums.Status.manualOff, Codec.RAW),
+    # Water Feature
+    ("wf", "wf_schedule1", _SCHEDULE_1_Char_UUID, _R | _W,
+     schedule.pack(18000, 25200, 127, 0, 5), Codec.SCHEDULE),
+    ("wf", "wf_schedule2", _SCHEDULE_2_Char_UUID, _R | _W,
+     schedule.pack(64800, 72000, 127, 0, 7), Codec.SCHEDULE),
+    ("wf", "wf_mode", _MODE_Char_UUID, _R | _W,
+     enums.Modes.ManualOff, Codec.RAW),
+    ("wf", "wf_status", _STATUS_Char_UUID, _R | _N,
+     enums.Status.manualOff, Codec.RAW),
+    # Heat
+    ("heat", "heat_schedule1", _SCHEDULE_1_Char_UUID, _R | _W,
+     schedule.pack(46800, 64800, 127, 0, 30, 1), Codec.SCHEDULE),
+    ("heat", "heat_schedule2", _SCHEDULE_2_Char_UUID, _R | _W,
+     schedule.pack(64800, 68400, 127, 0, 38, 2), Codec.SCHEDULE),
+    ("heat", "heat_manual_config", _MANUAL_CONFIG_Char_UUID, _R | _W | _N,
+     bytes([0x1C, 0x28]), Codec.RAW),  # 28C pool, 40C spa
+    ("heat", "heat_mode", _MODE_Char_UUID, _R | _W,
+     enums.HeaterModes.Off_Filter, Codec.RAW),
+    ("heat", "heat_status", _STATUS_Char_UUID, _R | _N,
+     enums.HeaterStatus.manualOff_Filter, Codec.RAW),
+    # Garden Light
+    ("gl", "gl_schedule1", _SCHEDULE_1_Char_UUID, _R | _W,
+     schedule.pack(18000, 25200, 127, 0, 5), Codec.SCHEDULE),
+    ("gl", "gl_schedule2", _SCHEDULE_2_Char_UUID, _R | _W,
+     schedule.pack(64800, 72000, 127, 0, 7), Codec.SCHEDULE),
+    ("gl", "gl_mode", _MODE_Char_UUID, _R | _W,
+     enums.Modes.ManualOff, Codec.RAW),
+    ("gl", "gl_status", _STATUS_Char_UUID, _R | _N,
+     enums.Status.manualOff, Codec.RAW),
+    # Spa Refill
+    ("spa_refill", "spa_refill_manual_config", _MANUAL_CONFIG_Char_UUID, _R | _W,
+     bytes([1]), Codec.U8),  # minutes
+    ("spa_refill", "spa_refill_mode", _MODE_Char_UUID, _R | _W,
+     enums.Modes.ManualOff, Codec.RAW),
+    ("spa_refill", "spa_refill_status", _STATUS_Char_UUID, _R | _N,
+     enums.Status.manualOff, Codec.RAW),
+    # Config
+    ("config", "lights_brand", _LIGHTS_BRAND_UUID, _R | _W,
+     enums.Light.Brands.SpaElectric, Codec.RAW),
+    ("config", "time_sync", _TIME_SYNC_UUID, _R | _W | _N,
+     None, Codec.RAW),
+    ("config", "command", _COMMAND_UUID, _W | _WNR,
+     None, Codec.RAW),  # see _COMMAND_FIELDS
+    # Status
+    ("status", "water_temperature", _WATER_TEMPERATURE_UUID, _R | _N,
+     b"\x00\x80", Codec.I16),  # WATER_TEMPERATURE_UNKNOWN
+    ("status", "system_status", _SYSTEM_STATUS_UUID, _R | _N,
+     bytes(19), Codec.RAW),  # see _SYSTEM_STATUS_FIELDS
+)
+
+# System Status: packed snapshot for a single read app refresh
+# sequence: u16, one byte per field below, water temperature: i16 centi Celsius
+# field: characteristic name, byte index in its value
+# also the library.state slots, refer to enums.Slot
+_SYSTEM_STATUS_FIELDS = (
+    ("lights_mode", 0),
+    ("lights_status", 0),
+    ("lights_manual_config", 0),  # colour
+    ("lights_brand", 0),
+    ("wf_mode", 0),
+    ("wf_status", 0),
+    ("heat_mode", 0),
+    ("heat_status", 0),
+    ("heat_manual_config", 0),  # pool setpoint
+    ("heat_manual_config", 1),  # spa setpoint
+    ("gl_mode", 0),
+    ("gl_status", 0),
+    ("spa_refill_mode", 0),
+    ("spa_refill_status", 0),
+    ("spa_refill_manual_config", 0),  # minutes
+)
+_SYSTEM_STATUS_TEMP_OFFSET = const(17)
+
+# Schedules kept unpacked in the library.state slots following the System Status ones
+_SCHEDULE_FIELDS = (
+    "lights_schedule1",
+    "lights_schedule2",
+    "wf_schedule1",
+    "wf_schedule2",
+    "heat_schedule1",
+    "heat_schedule2",
+    "gl_schedule1",
+    "gl_schedule2",
+)
+
+# Command: batch of field updates applied atomically in one write
+# repeated: field id: u8, length: u8, value: bytes (same format and length as the field characteristic default)
+# field id is the index in this tuple, only append to it
+_COMMAND_FIELDS = (
+    "lights_schedule1",
+    "lights_schedule2",
+    "lights_manual_config",
+    "lights_mode",
+    "wf_schedule1",
+    "wf_schedule2",
+    "wf_mode",
+    "heat_schedule1",
+    "heat_schedule2",
+    "heat_manual_config",
+    "heat_mode",
+    "gl_schedule1",
+    "gl_schedule2",
+    "gl_mode",
+    "spa_refill_manual_config",
+    "spa_refill_mode",
+    "lights_brand",
+)
+
+_IRQ_GATTS_WRITE = const(3)
+_CCCD_NOTIFY = const(0x01)
+# pending writes are tracked as a bitmask, keep it a small int
+_MAX_WRITE_HANDLERS = const(30)
+# notifications are coalesced over a window and limited per window
+_NOTIFY_WINDOW_MS = const(30)
+_NOTIFY_BUDGET = const(4)
 
 
 def get_ble_mac():
@@ -56,6 +227,8 @@ class BLEManager:
     # How frequently to send advertising beacons.
     _ADV_INTERVAL_MS = 250_000
 
+    # Schedules use the library.schedule binary format (legacy ASCII is still accepted)
+
     # Lights
     # Schedule 1: Start, End, Days, Enabled, Config
     # Schedule 2: Start, End, Days, Enabled, Config
@@ -90,280 +263,292 @@ class BLEManager:
     # Mode: Off, On
     # Status: TRANSITION, Manual Off, Manual On
 
+    # Command
+    # Field updates applied atomically in one write (write without response supported)
+    # refer to _COMMAND_FIELDS
+
+    # Status
+    # Water Temperature: centi Celsius, signed 16 bit, -32768 when unknown
+    # System Status: Sequence, Lights/WF/Heat/GL/Spa Refill modes, statuses and config, Water Temperature
+    #                refer to _SYSTEM_STATUS_FIELDS, notified once per burst of changes
+
     def __init__(self, i2c):
         self.i2c = i2c
         self.serial_number = get_ble_mac()
         self._connection = None
-        # Create the BLE Services and Characteristics
-        # Light GATT Service
-        self.lights_service = aioble.Service(_lights_Service_UUID)
-        self.lights_schedule1_char = aioble.Characteristic(
-            self.lights_service, _SCHEDULE_1_Char_UUID, read=True, write=True)
-        self.lights_schedule2_char = aioble.Characteristic(
-            self.lights_service, _SCHEDULE_2_Char_UUID, read=True, write=True)
-        self.lights_manual_config_char = aioble.Characteristic(
-            self.lights_service, _MANUAL_CONFIG_Char_UUID, read=True, write=True,  notify=True)
-        self.lights_mode_char = aioble.Characteristic(
-            self.lights_service, _MODE_Char_UUID, read=True, write=True)
-        self.lights_status_char = aioble.Characteristic(
-            self.lights_service, _STATUS_Char_UUID, read=True, notify=True)
-        # Water Feature GATT Service
-        self.wf_service = aioble.Service(_wf_Service_UUID)
-        self.wf_schedule1_char = aioble.Characteristic(
-            self.wf_service, _SCHEDULE_1_Char_UUID, read=True, write=True)
-        self.wf_schedule2_char = aioble.Characteristic(
-            self.wf_service, _SCHEDULE_2_Char_UUID, read=True, write=True)
-        self.wf_mode_char = aioble.Characteristic(
-            self.wf_service, _MODE_Char_UUID, read=True, write=True)
-        self.wf_status_char = aioble.Characteristic(
-            self.wf_service, _STATUS_Char_UUID, read=True, notify=True)
-        # Heat GATT Service
-        self.heat_service = aioble.Service(_heat_Service_UUID)
-        self.heat_schedule1_char = aioble.Characteristic(
-            self.heat_service, _SCHEDULE_1_Char_UUID, read=True, write=True)
-        self.heat_schedule2_char = aioble.Characteristic(
-            self.heat_service, _SCHEDULE_2_Char_UUID, read=True, write=True)
-        self.heat_manual_config_char = aioble.Characteristic(
-            self.heat_service, _MANUAL_CONFIG_Char_UUID, read=True, write=True, notify=True)
-        self.heat_mode_char = aioble.Characteristic(
-            self.heat_service, _MODE_Char_UUID, read=True, write=True)
-        self.heat_status_char = aioble.Characteristic(
-            self.heat_service, _STATUS_Char_UUID, read=True, notify=True)
-        # Garden Light GATT Service
-        self.gl_service = aioble.Service(_gl_Service_UUID)
-        self.gl_schedule1_char = aioble.Characteristic(
-            self.gl_service, _SCHEDULE_1_Char_UUID, read=True, write=True)
-        self.gl_schedule2_char = aioble.Characteristic(
-            self.gl_service, _SCHEDULE_2_Char_UUID, read=True, write=True)
-        self.gl_mode_char = aioble.Characteristic(
-            self.gl_service, _MODE_Char_UUID, read=True, write=True)
-        self.gl_status_char = aioble.Characteristic(
-            self.gl_service, _STATUS_Char_UUID, read=True, notify=True)
-
-        # Spa Refill GATT Service
-        self.spa_refill_service = aioble.Service(_spa_refill_Service_UUID)
-        self.spa_refill_manual_config_char = aioble.Characteristic(
-            self.spa_refill_service, _MANUAL_CONFIG_Char_UUID, read=True, write=True)
-        self.spa_refill_mode_char = aioble.Characteristic(
-            self.spa_refill_service, _MODE_Char_UUID, read=True, write=True)
-        self.spa_refill_status_char = aioble.Characteristic(
-            self.spa_refill_service, _STATUS_Char_UUID, read=True, notify=True)
-
-        # Config GATT Service
-        self.config_service = aioble.Service(_config_Service_UUID)
-        self.lights_brand_char = aioble.Characteristic(
-            self.config_service, _LIGHTS_BRAND_UUID, read=True, write=True)
-        self.time_sync_char = aioble.Characteristic(
-            self.config_service, _TIME_SYNC_UUID, read=True, write=True, notify=True)
-
-        # Status GATT Service
-        self.status_service = aioble.Service(_status_Service_UUID)
-        self.water_temperature_char = aioble.Characteristic(
-            self.status_service, _WATER_TEMPERATURE_UUID, read=True, notify=True)
-
-        # Initialise the BLE Peripheral Task
+        self._codecs = {}
+        self._notifiable = {}  # characteristic -> name
+        self._status_seq = 0
+        self._status_dirty = True
+        self._status_buf = bytearray(19)
+        self.water_temperature_centiC = WATER_TEMPERATURE_UNKNOWN
+        self._water_temperature_buf = bytearray(2)
+        self._notify_pending = []
+        self._notify_flag = aio.ThreadSafeFlag()
+        self._ble = bluetooth.BLE()
+        self._cccd_handles = {}  # CCCD handle -> characteristic
+        self._subscribed = {}  # characteristic -> bool, for the current connection
+        self.notify_sent = 0  # to a subscribed client
+        self.notify_suppressed = 0  # not connected or not subscribed
+        self.notify_unknown = 0  # handed to the stack with the subscription unknown
+        self.version = 0  # incremented on every characteristic change, for cheap change checks
+        self._connected_event = aio.Event()
+        # called when a schedule or the clock changes, i.e. ScheduleService.rearm
+        self.schedule_changed = None
+        # called when the spa refill mode is written off, i.e. Countdown.cancel
+        self.spa_refill_cancel = None
+        self._build_gatt()
+
+        # Write dispatcher, see _task_write_dispatcher
+        self._write_table = []
+        self._write_handles = {}
+        self._write_pending = 0
+        self._write_flag = aio.ThreadSafeFlag()
+        self._register_write_handlers()
+        register_irq_handler(self._write_irq, None)
+
+        # the characteristics mirror the state store, seeded from the schema defaults
+        for char in self._state_fields:
+            self._char_to_state(char)
+        for char in self._schedule_chars:
+            self._char_to_state(char)
+        # the slots after the schedules are not bound to a characteristic
+        state.subscribe(self._on_state, range(enums.Slot.slot_schedule_edge))
+
+    def _build_gatt(self):
+        '''
+        Create the GATT services and characteristics from _SCHEMA
+        Services are set as <prefix>_service and characteristics as <name>_char
+        '''
+        services = {}
+        lengths = {}
+        for prefix, uuid in _SERVICES:
+            service = aioble.Service(bluetooth.UUID(uuid))
+            services[prefix] = service
+            setattr(self, prefix + "_service", service)
+        for prefix, name, uuid, flags, default, codec in _SCHEMA:
+            char = aioble.Characteristic(
+                services[prefix], bluetooth.UUID(uuid),
+                read=bool(flags & _R), write=bool(flags & _W),
+                write_no_response=bool(flags & _WNR),
+                notify=bool(flags & _N), initial=default)
+            setattr(self, name + "_char", char)
+            if flags & _N:
+                self._notifiable[char] = name
+            self._codecs[name] = codec
+            if default is not None:
+                lengths[name] = len(default)
+        # command field id -> (characteristic, value length)
+        self._command_fields = tuple((getattr(self, name + "_char"), lengths[name])
+                                     for name in _COMMAND_FIELDS)
+        self._services = tuple(services[prefix] for prefix, _ in _SERVICES)
+        self._status_fields = tuple((getattr(self, name + "_char"), index)
+                                    for name, index in _SYSTEM_STATUS_FIELDS)
+        self._status_sources = {char: True for char, _ in self._status_fields}
+        # characteristic -> ((byte index, state slot), ...)
+        self._state_fields = {}
+        for slot, (char, index) in enumerate(self._status_fields):
+            self._state_fields[char] = self._state_fields.get(char, ()) + ((index, slot),)
+        self._schedule_chars = tuple(getattr(self, name + "_char")
+                                     for name in _SCHEDULE_FIELDS)
+        # characteristic -> state slot
+        self._schedule_slots = {char: enums.Slot.slot_lights_schedule1 + i
+                                for i, char in enumerate(self._schedule_chars)}
+        self._adv_services = tuple(bluetooth.UUID(uuid)
+                                   for _, uuid in _SERVICES)
+
         try:
-            aioble.register_services(
-                self.lights_service,
-                self.wf_service,
-                self.heat_service,
-                self.gl_service,
-                self.config_service,
-                self.spa_refill_service,
-                self.status_service,
-            )
+            aioble.register_services(*self._services)
         except Exception as e:
             log.error(f"BLE Services Registration Error: {e}")
+        # the CCCD is registered right after the characteristic value
+        for char in self._notifiable:
+            if char._value_handle is not None:
+                self._cccd_handles[char._value_handle + 1] = char
 
     '''
-    Lights
+    Write Dispatcher
+    A single task handles writes to every characteristic.
+    The aioble IRQ hook flags the written value handle in a bitmask,
+    the dispatcher task then looks the handle up in the table and calls the handler.
     '''
 
-    async def _task_lights_schedule1(self):
-        while True:
-            await self.lights_schedule1_char.written()
-            schedule = self.lights_schedule1_char.read()
-            log.info(f"Lights Schedule 1 Updated:{schedule}")
-            # Update the lights schedule 1
-            # call the lights schedule 1 update function
+    def _register_write_handlers(self):
+        # characteristic, log name, handler (None to only log the update)
+        table = (
+            (self.lights_schedule1_char, "Lights Schedule 1", self._on_schedule),
+            (self.lights_schedule2_char, "Lights Schedule 2", self._on_schedule),
+            (self.lights_manual_config_char, "Lights Manual Config", None),
+            (self.lights_mode_char, "Lights Mode", self._on_lights_mode),
+
+            (self.wf_schedule1_char, "Water Feature Schedule 1", self._on_schedule),
+            (self.wf_schedule2_char, "Water Feature Schedule 2", self._on_schedule),
+            (self.wf_mode_char, "Water Feature Mode", None),
+
+            (self.heat_schedule1_char, "Heat Schedule 1", self._on_schedule),
+            (self.heat_schedule2_char, "Heat Schedule 2", self._on_schedule),
+            (self.heat_manual_config_char, "Heat Manual Config", None),
+            (self.heat_mode_char, "Heat Mode", self._on_heat_mode),
+
+            (self.gl_schedule1_char, "Garden Light Schedule 1", self._on_schedule),
+            (self.gl_schedule2_char, "Garden Light Schedule 2", self._on_schedule),
+            (self.gl_mode_char, "Garden Light Mode", None),
+
+            (self.spa_refill_manual_config_char, "Spa Refill Manual Config", None),
+            (self.spa_refill_mode_char, "Spa Refill Mode", self._on_spa_refill_mode),
+
+            (self.lights_brand_char, "Lights Brand", None),
+            (self.time_sync_char, "Time Sync", self._on_time_sync),
+            (self.command_char, "Command", self._on_command),
+        )
+        for char, name, handler in table:
+            self.register_write_handler(char, name, handler)
 
-    async def _task_lights_schedule2(self):
-        while True:
-            await self.lights_schedule2_char.written()
-            schedule = self.lights_schedule2_char.read()
-            log.info(f"Lights Schedule 2 Updated:{schedule}")
-            # Update the lights schedule 2
-            # call the lights schedule 2 update function
+    def register_write_handler(self, char, name, handler=None):
+        '''
+        Call handler(value) when the client writes to char
+        Char must be a registered Characteristic object
+        '''
+        if len(self._write_table) >= _MAX_WRITE_HANDLERS:
+            raise ValueError("Too many write handlers")
+        self._write_handles[char._value_handle] = len(self._write_table)
+        self._write_table.append((char, name, handler))
+
+    def _write_irq(self, event, data):
+        if event == _IRQ_GATTS_WRITE:
+            index = self._write_handles.get(data[1])
+            if index is not None:
+                self._write_pending |= 1 << index
+                self._write_flag.set()
+            else:
+                char = self._cccd_handles.get(data[1])
+                if char is not None:
+                    self._on_cccd_write(char, data[1])
 
-    async def _task_lights_manual_config(self):
-        while True:
-            await self.lights_manual_config_char.written()
-            manual_config = self.lights_manual_config_char.read()
-            log.info(f"Lights Manual Config Updated:{manual_config}")
-            # Update the lights manual config
+    def _read_cccds(self):
+        '''
+        Seed the subscriptions of a new connection from the CCCDs (i.e. a bonded client)
+        NOTE: on ESP32 (NimBLE) the CCCDs are kept inside the stack, gatts_read raises OSError
+        and the _IRQ_GATTS_WRITE of a CCCD carries no value, so subscription tracking is a
+        no-op there: is_subscribed() is always None, notifications are handed to the stack
+        (counted as unknown, the stack only sends them to subscribers) and none are
+        suppressed as unsubscribed. It only takes effect on stacks exposing the CCCDs (btstack).
+        '''
+        self._subscribed.clear()
+        for cccd_handle, char in self._cccd_handles.items():
+            try:
+                cccd = self._ble.gatts_read(cccd_handle)
+            except OSError:
+                log.debug("CCCDs are not readable, subscriptions are left to the stack")
+                return
+            if cccd:
+                self._subscribed[char] = bool(cccd[0] & _CCCD_NOTIFY)
+
+    def _on_cccd_write(self, char, cccd_handle):
+        '''
+        Client changed the Client Characteristic Configuration Descriptor of char
+        '''
+        try:
+            cccd = self._ble.gatts_read(cccd_handle)
+            self._subscribed[char] = bool(cccd[0] & _CCCD_NOTIFY)
+        except OSError:
+            # CCCD is not readable on this stack, leave the stack to decide
+            self._subscribed.pop(char, None)
 
-    async def _task_lights_mode(self):
+    async def _task_write_dispatcher(self):
         while True:
-            await self.lights_mode_char.written()
-            mode = self.lights_mode_char.read()
-            log.info(f"Lights Mode Updated:{mode}")
-            self.update_char(self.lights_status_char, mode)
+            await self._write_flag.wait()
+            pending = self._write_pending
+            self._write_pending = 0
+            index = 0
+            while pending:
+                if pending & 1:
+                    char, name, handler = self._write_table[index]
+                    value = char.read()
+                    log.info("%s Updated:%s", name, value)
+                    self._on_char_changed(char)
+                    if handler is not None:
+                        try:
+                            handler(value)
+                        except Exception as e:
+                            log.error("%s Handler Error: %s", name, e)
+                pending >>= 1
+                index += 1
 
     '''
-    Water Feature
+    Write Handlers
     '''
 
-    async def _task_wf_schedule1(self):
-        while True:
-            await self.wf_schedule1_char.written()
-            schedule = self.wf_schedule1_char.read()
-            log.info(f"Water Feature Schedule 1 Updated:{schedule}")
-            # Update the water feature schedule 1
-            # call the water feature schedule 1 update function
+    def _on_schedule(self, value):
+        if self.schedule_changed is not None:
+            self.schedule_changed()
 
-    async def _task_wf_schedule2(self):
-        while True:
-            await self.wf_schedule2_char.written()
-            schedule = self.wf_schedule2_char.read()
-            log.info(f"Water Feature Schedule 2 Updated:{schedule}")
-            # Update the water feature schedule 2
-            # call the water feature schedule 2 update function
+    def _on_lights_mode(self, mode):
+        self.update_char(self.lights_status_char, mode)
 
-    async def _task_wf_mode(self):
-        while True:
-            await self.wf_mode_char.written()
-            mode = self.wf_mode_char.read()
-            log.info(f"Water Feature Mode Updated:{mode}")
-            # Update the water feature mode
-            # call the water feature mode update function
+    def _on_heat_mode(self, mode):
+        if mode != enums.HeaterModes.Automatic:
+            self.update_char(self.heat_status_char,
+                             enums.HeaterStatus.transition_)
 
-    '''
-    Heat
-    '''
+    def _on_spa_refill_mode(self, mode):
+        self.update_char(self.spa_refill_status_char,
+                         enums.Status.transition)
+        if mode == enums.Modes.ManualOff and self.spa_refill_cancel is not None:
+            self.spa_refill_cancel()
 
-    async def _task_heat_schedule1(self):
-        while True:
-            await self.heat_schedule1_char.written()
-            schedule = self.heat_schedule1_char.read()
-            log.info(f"Heat Schedule 1 Updated:{schedule}")
-            # Update the heat schedule 1
-            # call the heat schedule 1 update function
-
-    async def _task_heat_schedule2(self):
-        while True:
-            await self.heat_schedule2_char.written()
-            schedule = self.heat_schedule2_char.read()
-            log.info(f"Heat Schedule 2 Updated:{schedule}")
-            # Update the heat schedule 2
-            # call the heat schedule 2 update function
-
-    async def _task_heat_manual_config(self):
-        while True:
-            await self.heat_manual_config_char.written()
-            manual_config = self.heat_manual_config_char.read()
-            pool = manual_config[0]
-            spa = manual_config[1]
+    def _on_time_sync(self, time_sync):
+        try:
+            t = time_sync.hex()
+            yyyy, mm, dd, HH, MM, SS = (int(i) for i in (
+                t[0:4], t[4:6], t[6:8], t[8:10], t[10:12], t[12:14]))
             log.info(
-                f"Heat Manual Config Updated: {hex(manual_config[0]), hex(manual_config[1])}; Pool: {pool}C, Spa: {spa}C")
-            # Update the heat manual config
-            # call the heat manual config update function
-
-    async def _task_heat_mode(self):
-        while True:
-            await self.heat_mode_char.written()
-            mode = self.heat_mode_char.read()
-            log.info(f"Heat Mode Updated:{mode}")
-            if mode != enums.HeaterModes.Automatic:
-                self.update_char(self.heat_status_char,
-                                 enums.HeaterStatus.transition_)
-            # Update the heat mode
-            # call the heat mode update function
-
-    '''
-    Garden Light
-    '''
-
-    async def _task_gl_schedule1(self):
-        while True:
-            await self.gl_schedule1_char.written()
-            schedule = self.gl_schedule1_char.read()
-            log.info(f"Garden Light Schedule 1 Updated:{schedule}")
-            # Update the garden light schedule 1
-            # call the garden light schedule 1 update function
-
-    async def _task_gl_schedule2(self):
-        while True:
-            await self.gl_schedule2_char.written()
-            schedule = self.gl_schedule2_char.read()
-            log.info(f"Garden Light Schedule 2 Updated:{schedule}")
-            # Update the garden light schedule 2
-            # call the garden light schedule 2 update function
-
-    async def _task_gl_mode(self):
-        while True:
-            await self.gl_mode_char.written()
-            mode = self.gl_mode_char.read()
-            log.info(f"Garden Light Mode Updated:{mode}")
-            # Update the garden light mode
-            # call the garden light mode update function
-
-    '''
-    Spa Refill
-    '''
-
-    async def _task_spa_refill_manual_config(self):
-        while True:
-            await self.spa_refill_manual_config_char.written()
-            manual_config = self.spa_refill_manual_config_char.read()
-            log.info(f"Spa Refill Manual Config Updated:{manual_config}")
-            # Update the spa refill manual config
-            # call the spa refill manual config update function
-
-    async def _task_spa_refill_mode(self):
-        while True:
-            await self.spa_refill_mode_char.written()
-            mode = self.spa_refill_mode_char.read()
-            log.info(f"Spa Refill Mode Updated:{mode}")
-            self.update_char(self.spa_refill_status_char,
-                             enums.Status.transition)
-            # Update the spa refill mode
-            # call the spa refill mode update function
-
-    '''
-    Config
-    '''
-
-    async def _task_lights_brand(self):
-        while True:
-            await self.lights_brand_char.written()
-            brand = self.lights_brand_char.read()
-            if brand is not None:
-                log.info(f"Lights Brand Updated: {brand}")
-            else:
-                log.info(f"Lights Brand Updated: None")
+                f"Time Sync Updated: {time_sync} {t}: {yyyy, mm, dd, HH, MM, SS}")
+            set_external_rtc(datetimeTuple=(yyyy, mm, dd, 0, HH, MM, SS, 0),
+                             i2c=self.i2c)
+            clock.sync()
+            self._on_schedule(time_sync)
+        except Exception as e:
+            log.error(f"Time Sync Error: {e}")
 
-    async def _task_time_sync(self):
-        while True:
-            await self.time_sync_char.written()
-            time_sync = self.time_sync_char.read()
-            try:
-                t = time_sync.hex()
-                yyyy, mm, dd, HH, MM, SS = (int(i) for i in (
-                    t[0:4], t[4:6], t[6:8], t[8:10], t[10:12], t[12:14]))
-                if t is not None:
-                    log.info(
-                        f"Time Sync Updated: {time_sync} {t}: {yyyy, mm, dd, HH, MM, SS}")
-                    set_external_rtc(datetimeTuple=(yyyy, mm, dd, 0, HH, MM, SS, 0),
-                                     i2c=self.i2c)
-                else:
-                    log.info(f"Time Sync Updated: None")
-            except Exception as e:
-                log.error(f"Time Sync Error: {e}")
+    def _on_command(self, command):
+        '''
+        Apply a batch of field updates, refer to _COMMAND_FIELDS
+        Every field is checked before any is applied, an invalid one rejects the whole command.
+        All values are written before any handler runs or notification is queued,
+        so the controllers only see the final state.
+        '''
+        updates = []
+        i = 0
+        while i + 2 <= len(command):
+            field = command[i]
+            length = command[i + 1]
+            if (field >= len(self._command_fields) or length != self._command_fields[field][1] or
+                    i + 2 + length > len(command)):
+                log.error("Invalid Command field %d at %d: %s", field, i, command)
+                return
+            updates.append((self._command_fields[field][0],
+                            command[i + 2:i + 2 + length]))
+            i += 2 + length
+        if i != len(command):
+            log.error("Invalid Command: %s", command)
+            return
+        for char, value in updates:
+            self.write_char(char, value)
+            self._on_char_changed(char)
+        for char, value in updates:
+            self.schedule_notify(char)
+            _, name, handler = self._write_table[self._write_handles[char._value_handle]]
+            if handler is not None:
+                try:
+                    handler(value)
+                except Exception as e:
+                    log.error("%s Handler Error: %s", name, e)
 
     '''
     Status
     '''
-    # NOTE: Status are read only, so they don't need a task
+    # NOTE: Status are read only, so they don't need a handler
     # Water Temperature
 
     '''
@@ -378,48 +563,21 @@ class BLEManager:
             async with await aioble.advertise(
                 BLEManager._ADV_INTERVAL_MS,
                 name=name,
-                services=[
-                    _lights_Service_UUID,
-                    _wf_Service_UUID,
-                    _heat_Service_UUID,
-                    _gl_Service_UUID,
-                    _spa_refill_Service_UUID,
-                    _config_Service_UUID,
-                    _status_Service_UUID,
-                ],
+                services=self._adv_services,
             ) as self._connection:  # type: ignore
+                self._read_cccds()
+                self._connected_event.set()
                 log.warning(f"Connection from {self._connection.device}")
                 await self._connection.disconnected()
                 log.warning("Disconnected!")
+                self._connected_event.clear()
                 self._connection = None
 
     async def tasks(self):
         await aio.gather(
             self._task_ble_peripheral(),
-
-            self._task_lights_schedule1(),
-            self._task_lights_schedule2(),
-            self._task_lights_manual_config(),
-            self._task_lights_mode(),
-
-            self._task_wf_schedule1(),
-            self._task_wf_schedule2(),
-            self._task_wf_mode(),
-
-            self._task_heat_schedule1(),
-            self._task_heat_schedule2(),
-            self._task_heat_manual_config(),
-            self._task_heat_mode(),
-
-            self._task_gl_schedule1(),
-            self._task_gl_schedule2(),
-            self._task_gl_mode(),
-
-            self._task_spa_refill_manual_config(),
-            self._task_spa_refill_mode(),
-
-            self._task_lights_brand(),
-            self._task_time_sync(),
+            self._task_write_dispatcher(),
+            self._task_notify(),
         )
 
     def write_char(self, char, value):
@@ -436,32 +594,207 @@ class BLEManager:
         Char must be a Characteristic object
         Value must be a bytes object,
             if Value is None, then the characteristic is notified with last value
+        Notifications to an unsubscribed client are skipped and counted as suppressed
         '''
-        if self._connection is not None:
-            # check if notify is enabled
-            try:
-                if value is not None:
-                    char.notify(self._connection, value)
-                else:
-                    char.notify(self._connection)
-                return True
-            except ValueError:
-                log.debug("BLE Notify Failed: notify not enabled")
-                return False
-        log.debug("BLE Notify Failed: No Connection")
-        return False
+        if char not in self._notifiable:
+            return False
+        if self._connection is None:
+            self.notify_suppressed += 1
+            return False
+        subscribed = self._subscribed.get(char)
+        if subscribed is None:
+            # subscription unknown, the stack only notifies subscribed clients
+            if value is not None:
+                char.write(value, send_update=True)
+            else:
+                char.write(char.read(), send_update=True)
+            self.notify_unknown += 1
+            return True
+        elif subscribed:
+            if value is not None:
+                char.notify(self._connection, value)
+            else:
+                char.notify(self._connection)
+        else:
+            self.notify_suppressed += 1
+            return False
+        self.notify_sent += 1
+        return True
+
+    def notify_stats(self):
+        '''
+        Return the (sent, suppressed, unknown) notification counters
+        unknown are the ones handed to the stack while the subscription was not reported
+        '''
+        return self.notify_sent, self.notify_suppressed, self.notify_unknown
 
     def update_char(self, char, value):
         '''
-        Write and notify a value to a characteristic
+        Write a value to a characteristic and schedule its notification
         Char must be a Characteristic object
         Value must be a bytes object
+        Notifications are coalesced, see _task_notify
         '''
         self.write_char(char, value)
-        return self.notify_char(char, value)
+        self._on_char_changed(char)
+        return self.schedule_notify(char)
+
+    def schedule_notify(self, char):
+        '''
+        Queue a notification of the current value of char
+        Returns True if the notification is queued
+        '''
+        if char not in self._notifiable:
+            return False
+        # counted as in notify_char
+        if self._connection is None or self._subscribed.get(char) is False:
+            self.notify_suppressed += 1
+            return False
+        if char not in self._notify_pending:
+            self._notify_pending.append(char)
+            self._notify_flag.set()
+        return True
+
+    async def _task_notify(self):
+        '''
+        Send the queued notifications
+        Updates to the same characteristic within _NOTIFY_WINDOW_MS are sent once with the latest value,
+        at most _NOTIFY_BUDGET notifications are sent per window, the rest wait for the next one.
+        '''
+        pending = self._notify_pending
+        while True:
+            await self._notify_flag.wait()
+            while pending or self._status_dirty:
+                # let the burst settle
+                await aio.sleep_ms(_NOTIFY_WINDOW_MS)
+                if self._status_dirty:
+                    self._update_system_status()
+                if self._connection is None:
+                    self.notify_suppressed += len(pending)
+                    pending.clear()
+                    break
+                batch = pending[:_NOTIFY_BUDGET]
+                del pending[:_NOTIFY_BUDGET]
+                for char in batch:
+                    self.notify_char(char)
+
+    '''
+    System Status
+    '''
+
+    def _on_char_changed(self, char):
+        # every characteristic change goes through here
+        self.version += 1
+        if char in self._status_sources:
+            self._char_to_state(char)
+            self._status_dirty = True
+            self._notify_flag.set()
+        elif char in self._schedule_slots:
+            self._char_to_state(char)
+
+    def _char_to_state(self, char):
+        value = char.read()
+        slot = self._schedule_slots.get(char)
+        if slot is not None:
+            # an invalid schedule keeps the last good one
+            state.set(slot, schedule.unpack(value, state.get(slot) or schedule.DISABLED), self)
+            return
+        for index, slot in self._state_fields[char]:
+            state.set(slot, value[index] if len(value) > index else 0, self)
+
+    def _on_state(self, slot, value, source):
+        '''
+        State store change from the controllers or UI, write it to its characteristic
+        '''
+        if source is self:
+            return
+        if slot >= enums.Slot.slot_lights_schedule1:
+            char = self._schedule_chars[slot - enums.Slot.slot_lights_schedule1]
+            self.write_char(char, schedule.pack(*value))
+            self.version += 1
+            self.schedule_notify(char)
+            return
+        char, index = self._status_fields[slot]
+        buf = bytearray(char.read())
+        buf[index] = value
+        self.write_char(char, buf)
+        self.version += 1
+        self._status_dirty = True
+        self._notify_flag.set()
+        self.schedule_notify(char)
+
+    def _update_system_status(self):
+        '''
+        Rebuild the packed system status snapshot and queue its notification
+        '''
+        self._status_dirty = False
+        self._status_seq = (self._status_seq + 1) & 0xFFFF
+        buf = self._status_buf
+        struct.pack_into("<H", buf, 0, self._status_seq)
+        offset = 2
+        for slot in range(len(self._status_fields)):
+            buf[offset] = state.get(slot)
+            offset += 1
+        struct.pack_into("<h", buf, _SYSTEM_STATUS_TEMP_OFFSET,
+                         self.water_temperature_centiC)
+        self.update_char(self.system_status_char, buf)
+
+    def set_water_temperature(self, temperature_centiC):
+        '''
+        Publish the water temperature in centi Celsius
+        '''
+        self.water_temperature_centiC = temperature_centiC
+        struct.pack_into("<h", self._water_temperature_buf, 0, temperature_centiC)
+        self.update_char(self.water_temperature_char,
+                         self._water_temperature_buf)
+        self._status_dirty = True
+        self._notify_flag.set()
+
+    def get(self, name):
+        '''
+        Read the characteristic <name>_char decoded with its schema codec
+        '''
+        value = getattr(self, name + "_char").read()
+        codec = self._codecs[name]
+        if codec == Codec.U8:
+            return value[0]
+        elif codec == Codec.STR:
+            return value.decode()
+        elif codec == Codec.SCHEDULE:
+            return schedule.unpack(value)
+        elif codec == Codec.I16:
+            return struct.unpack_from("<h", value)[0]
+        return value
+
+    def set(self, name, value):
+        '''
+        Encode value with the schema codec of <name>_char, write and notify it
+        '''
+        codec = self._codecs[name]
+        if codec == Codec.U8:
+            value = bytes([value])
+        elif codec == Codec.STR:
+            value = value.encode()
+        elif codec == Codec.SCHEDULE:
+            value = schedule.pack(*value)
+        elif codec == Codec.I16:
+            value = struct.pack("<h", value)
+        return self.update_char(getattr(self, name + "_char"), value)
 
     def byte_to_int(self, byte):
         return int.from_bytes(byte, "little")
 
     def is_connected(self):
         return self._connection is not None
+
+    async def wait_connected(self):
+        await self._connected_event.wait()
+
+    def is_subscribed(self, char):
+        '''
+        True if the client enabled notifications for char, False if it did not,
+        None if no client is connected or the stack has not reported the CCCD
+        '''
+        if self._connection is None:
+            return None
+        return self._subscribed.get(char)
@@ -4,6 +4,21 @@ MicroPython driver for NXP PCF85063A RTC
 from machine import I2C
 from micropython import const
 
+# Registers
+_CONTROL_1 = const(0x00)
+_CONTROL_2 = const(0x01)
+_SECONDS = const(0x04)
+_SECOND_ALARM = const(0x0B)
+_TIMER_VALUE = const(0x10)
+_TIMER_MODE = const(0x11)
+
+# Control_2 bits
+_AIE = const(0x80)  # alarm interrupt enable
+_AF = const(0x40)  # alarm flag, writing 1 leaves it unchanged
+_TF = const(0x08)  # timer flag, writing 1 leaves it unchanged
+# Alarm registers bit 7 set disables the field
+_AEN_OFF = const(0x80)
+
 
 def _bcd_to_dec(bcd):
     return ((bcd // 16) * 10) + (bcd % 16)
@@ -32,17 +47,34 @@ class PCF85063A:
     def __init__(self, i2c: I2C, address: int = 0x51):
         self.i2c = i2c
         self.address = address
-        self._datetime_register = 0x04
+        self._datetime_register = _SECONDS
+        self._buf7 = bytearray(7)
+        self._buf1 = bytearray(1)
+        self.transactions = 0  # I2C transaction count
+        # cached Control_1 and Control_2 registers
+        self._control = bytearray(2)
+        self._read_into(_CONTROL_1, self._control)
         self.set_clockout_frequency(self.CLOCKOUT_FREQUENCY.Disabled)
         self.set_cap_sel(self.CAP_SEL.Cap_7_pF)
 
     def _write_byte(self, register, value):
-        self.i2c.writeto_mem(self.address, register, bytearray([value]))
+        self._buf1[0] = value
+        self._write(register, self._buf1)
+
+    def _write(self, register, buf):
+        self.transactions += 1
+        self.i2c.writeto_mem(self.address, register, buf)
 
     def _read_byte(self, register):
-        return self.i2c.readfrom_mem(self.address, register, 1)[0]
+        self._read_into(register, self._buf1)
+        return self._buf1[0]
+
+    def _read_into(self, register, buf):
+        self.transactions += 1
+        self.i2c.readfrom_mem_into(self.address, register, buf)
 
     def _read_bytes(self, register, length):
+        self.transactions += 1
         return self.i2c.readfrom_mem(self.address, register, length)
 
     @property
@@ -54,7 +86,8 @@ class PCF85063A:
         year, month, day, 0, hour, minute, second, 0
         first 0 is day of week and second 0 is milliseconds
         '''
-        data = self._read_bytes(self._datetime_register, 7)
+        data = self._buf7
+        self._read_into(self._datetime_register, data)
         second = _bcd_to_dec(data[0] & 0x7F)
         minute = _bcd_to_dec(data[1] & 0x7F)
         hour = _bcd_to_dec(data[2] & 0x3F)
@@ -67,51 +100,106 @@ class PCF85063A:
     @datetime.setter
     def datetime(self, dt: tuple[int, int, int, int, int, int, int, int]):
         '''
-        Sets the date and time of the RTC
+        Sets the date and time of the RTC in a single burst write
         The input is a tuple of 8 integers representing
         (compatible with mpy machine.RTC.datetime())
-        year, month, day, 0, hour, minute, second, 0
-        first 0 is day of week and second 0 is milliseconds
+        year, month, day, weekday, hour, minute, second, 0
+        second 0 is milliseconds
         '''
-        year = _dec_to_bcd(dt[0] - 2000)
-        month = _dec_to_bcd(dt[1] & 0x1F)
-        day = _dec_to_bcd(dt[2] & 0x3F)
-        # day of week not used 3
-        hour = _dec_to_bcd(dt[4] & 0x3F)
-        minute = _dec_to_bcd(dt[5] & 0x7F)
-        second = _dec_to_bcd(dt[6] & 0x7F)
+        data = self._buf7
+        data[0] = _dec_to_bcd(dt[6] & 0x7F)  # second
+        data[1] = _dec_to_bcd(dt[5] & 0x7F)  # minute
+        data[2] = _dec_to_bcd(dt[4] & 0x3F)  # hour
+        data[3] = _dec_to_bcd(dt[2] & 0x3F)  # day
+        data[4] = dt[3] & 0x07  # weekday
+        data[5] = _dec_to_bcd(dt[1] & 0x1F)  # month
+        data[6] = _dec_to_bcd(dt[0] - 2000)  # year
         # milliseconds not used 7
-        self._write_byte(self._datetime_register, second)
-        self._write_byte(self._datetime_register + 1, minute)
-        self._write_byte(self._datetime_register + 2, hour)
-        self._write_byte(self._datetime_register + 3, day)
-        self._write_byte(self._datetime_register + 5, month)
-        self._write_byte(self._datetime_register + 6, year)
+        self._write(self._datetime_register, data)
+
+    def _set_control(self, index, mask, value):
+        '''
+        Update bits of the cached Control_1 (index 0) or Control_2 (index 1) register,
+        the register is only written if it changes
+        '''
+        reg = (self._control[index] & ~mask & 0xFF) | (value & mask)
+        if reg != self._control[index]:
+            self._control[index] = reg
+            if index == 1:
+                # do not clear the alarm and timer flags
+                reg |= _AF | _TF
+            self._write_byte(_CONTROL_1 + index, reg)
 
     def set_clockout_frequency(self, frequency):
-        reg = self._read_byte(0x01)
-        reg = (reg & 0xF8) | (frequency & 0x07)
-        self._write_byte(0x01, reg)
+        self._set_control(1, 0x07, frequency)
 
     def set_cap_sel(self, cap):
-        reg = self._read_byte(0x00)
-        reg = (reg & 0xFE) | (cap & 0x01)
-        self._write_byte(0x00, reg)
+        self._set_control(0, 0x01, cap)
+
+    def set_alarm(self, hour, minute, second=0):
+        '''
+        Arm the daily alarm at hour:minute:second and enable the alarm interrupt
+        The INT pin is pulled low until the alarm flag is cleared
+        '''
+        data = self._buf7
+        data[0] = _dec_to_bcd(second)
+        data[1] = _dec_to_bcd(minute)
+        data[2] = _dec_to_bcd(hour)
+        data[3] = _AEN_OFF  # day
+        data[4] = _AEN_OFF  # weekday
+        self._write(_SECOND_ALARM, memoryview(data)[:5])
+        self.clear_alarm()
+        self._set_control(1, _AIE, _AIE)
+
+    def disable_alarm(self):
+        data = self._buf7
+        for i in range(5):
+            data[i] = _AEN_OFF
+        self._write(_SECOND_ALARM, memoryview(data)[:5])
+        self._set_control(1, _AIE, 0)
+        self.clear_alarm()
+
+    def clear_alarm(self):
+        '''
+        Clear the alarm flag, releasing the INT pin
+        Returns True if the alarm had fired
+        '''
+        reg = self._read_byte(_CONTROL_2)
+        if reg & _AF:
+            self._write_byte(_CONTROL_2, (reg & ~_AF) | _TF)
+            return True
+        return False
+
+    def attach_interrupt(self, pin, flag):
+        '''
+        Set flag (i.e. asyncio.ThreadSafeFlag) on the falling edge of the INT pin
+        pin: machine.Pin connected to the open drain INT output, with a pull up
+        '''
+        from machine import Pin
+        pin.irq(trigger=Pin.IRQ_FALLING, handler=lambda p: flag.set())
 
     def set_timer(self, timer_value, frequency):
-        self._write_byte(0x10, timer_value)
-        reg = self._read_byte(0x11)
+        self._write_byte(_TIMER_VALUE, timer_value)
+        reg = self._read_byte(_TIMER_MODE)
         reg = (reg & 0xF3) | ((frequency & 0x03) << 2)
-        self._write_byte(0x11, reg)
+        self._write_byte(_TIMER_MODE, reg)
+
+
+_pcf = None
 
 
 def get_pcf(i2c=None):
+    '''
+    Return the shared PCF85063A instance, it is only created again if a different I2C bus is given
+    '''
+    global _pcf
+    if _pcf is not None and (i2c is None or i2c is _pcf.i2c):
+        return _pcf
     from machine import I2C, Pin
-    from drivers.pcf85063a import PCF85063A
     if i2c is None:
         i2c = I2C(0, scl=Pin.board.I2C_SCL, sda=Pin.board.I2C_SDA)
-    pcf_rtc = PCF85063A(i2c)
-    return pcf_rtc
+    _pcf = PCF85063A(i2c)
+    return _pcf
 
 
 def set_mpy_rtc(log):
@@ -130,17 +218,15 @@ def set_mpy_rtc(log):
 def set_external_rtc(log=None, datetimeTuple=None, i2c=None):
     '''
     Use internal RTC to set external RTC
+    The RTC times are only read back for logging when log is given
     '''
     from machine import RTC
-    if log is None:
-        log = print
     pcf_rc = get_pcf(i2c)
-    log(f"External RTC Time: {pcf_rc.datetime}")
-    log(f"Internal RTC Time: {RTC().datetime()}")
+    if log is not None:
+        log(f"External RTC Time: {pcf_rc.datetime}")
+        log(f"Internal RTC Time: {RTC().datetime()}")
     if datetimeTuple is not None:
-        log("Setting Internal RTC Time from input...")
         RTC().datetime(datetimeTuple)
-        log(f"New Internal RTC Time: {RTC().datetime()}")
-    log("Setting External RTC from Internal RTC Time...")
     pcf_rc.datetime = RTC().datetime()
-    log(f"New External RTC Time: {pcf_rc.datetime}")
+    if log is not None:
+        log(f"New External RTC Time: {pcf_rc.datetime}")
@@ -63,3 +63,38 @@ class Light:
         White = const(7)
         Slow = const(8)
         Fast = const(9)
+
+
+class Slot:
+    '''
+    library.state slots, the System Status bytes in their order (refer to ble_manager), the schedules, then the
+    controller only ones
+    prefixed as the names must be unique in this module, refer to NOTE
+    '''
+    slot_lights_mode = const(0)
+    slot_lights_status = const(1)
+    slot_lights_colour = const(2)
+    slot_lights_brand = const(3)
+    slot_wf_mode = const(4)
+    slot_wf_status = const(5)
+    slot_heat_mode = const(6)
+    slot_heat_status = const(7)
+    slot_heat_pool_setpoint = const(8)
+    slot_heat_spa_setpoint = const(9)
+    slot_gl_mode = const(10)
+    slot_gl_status = const(11)
+    slot_spa_refill_mode = const(12)
+    slot_spa_refill_status = const(13)
+    slot_spa_refill_minutes = const(14)
+    # unpacked schedule tuples, refer to library.schedule.unpack
+    slot_lights_schedule1 = const(15)
+    slot_lights_schedule2 = const(16)
+    slot_wf_schedule1 = const(17)
+    slot_wf_schedule2 = const(18)
+    slot_heat_schedule1 = const(19)
+    slot_heat_schedule2 = const(20)
+    slot_gl_schedule1 = const(21)
+    slot_gl_schedule2 = const(22)
+    # library.schedule.ScheduleService edge count, wakes the controllers on a schedule start/end
+    slot_schedule_edge = const(23)
+    slot_count = const(24)
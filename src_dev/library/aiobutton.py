@@ -1,9 +1,10 @@
 from micropython import const
+from array import array
 import uasyncio as aio
 
 # Module version
 __version__ = "0.1.0"
-__all__ = ["AIOButton"]
+__all__ = ["AIOButton", "ButtonGroup"]
 
 H_INPUT = const(0)
 H_PRESS = const(1)
@@ -99,3 +100,128 @@ class AIOButton(object):
                         self.para_list[T_HOLD] = 0
                     if self.para_list[H_HOLD]:
                         self.para_list[H_HOLD](self)
+
+
+class ButtonGroup(object):
+    """
+    Debounce up to 8 buttons that share a single input port byte in one task.
+
+    Debouncing is done on the whole port at once with a 2-bit vertical counter,
+    a bit only changes state after it has been stable for 4 consecutive scans
+    (4 x check_ms). Hold/repeat countdowns are kept in a compact array indexed
+    by bit, and press/release/hold handlers are dispatched from the same loop.
+    Handlers are called with the bit index of the button.
+    As with AIOButton, release is not called after a single (hold_repeat=False)
+    hold, but it is still called after repeating holds.
+    """
+
+    def __init__(self, read_port, active_low=True, check_ms=12, width=8):
+        """
+        read_port: function returning the raw port value as an int
+        active_low: True if a pressed button reads as 0
+        check_ms: scan period, debounce time is 4 x check_ms
+        width: number of bits in the port
+        """
+        self._read_port = read_port
+        self._mask = (1 << width) - 1
+        self._invert = self._mask if active_low else 0
+        self.check_ms = check_ms
+        self._used = 0  # bits with a registered button
+        self._state = 0  # debounced state, 1 is pressed
+        self._cnt0 = 0  # vertical counter, low bit
+        self._cnt1 = 0  # vertical counter, high bit
+        self._timing = 0  # bits with a running hold countdown
+        self._held = 0  # bits where a single hold has fired, release is suppressed
+        self._t_hold = array("i", (0 for _ in range(width)))
+        self._hold_ms = array("i", (0 for _ in range(width)))
+        self._repeat_ms = array("i", (0 for _ in range(width)))
+        self._h_press = [None] * width
+        self._h_release = [None] * width
+        self._h_hold = [None] * width
+
+    def add(
+        self,
+        bit,
+        h_press=None,
+        h_release=None,
+        h_hold=None,
+        hold_ms=1000,
+        hold_repeat=True,
+        hold_repeat_ms=333,  # roughly 3 times per second
+    ):
+        if not 0 <= bit < len(self._h_press):
+            raise ValueError(f"Invalid bit {bit}")
+        self._used |= 1 << bit
+        self._h_press[bit] = h_press
+        self._h_release[bit] = h_release
+        self._h_hold[bit] = h_hold
+        self._hold_ms[bit] = hold_ms
+        self._repeat_ms[bit] = hold_repeat_ms if hold_repeat else 0
+        return bit
+
+    def get_debounced(self, bit):
+        return bool((self._state >> bit) & 1)
+
+    def scan(self, sample):
+        """
+        Feed one raw port sample, returns the bits that changed state.
+        """
+        mask = self._used
+        sample = (sample ^ self._invert) & mask
+        delta = sample ^ self._state
+        # increment the counters of changed bits, reset the stable ones
+        self._cnt1 = (self._cnt1 ^ self._cnt0) & delta
+        self._cnt0 = ~self._cnt0 & delta & mask
+        changes = delta & ~(self._cnt0 | self._cnt1)
+        self._state ^= changes
+        return changes
+
+    def _dispatch(self, changes):
+        state = self._state
+        bit = 0
+        while changes:
+            if changes & 1:
+                b = 1 << bit
+                if state & b:
+                    self._held &= ~b
+                    if self._hold_ms[bit] > 0:
+                        self._t_hold[bit] = self._hold_ms[bit]
+                        self._timing |= b
+                    if self._h_press[bit]:
+                        self._h_press[bit](bit)
+                else:
+                    self._timing &= ~b
+                    # this is to not perform release after hold
+                    if not self._held & b and self._h_release[bit]:
+                        self._h_release[bit](bit)
+                    self._held &= ~b
+            changes >>= 1
+            bit += 1
+
+    def _tick_hold(self, elapsed_ms):
+        timing = self._timing
+        bit = 0
+        while timing:
+            if timing & 1:
+                t = self._t_hold[bit] - elapsed_ms
+                if t <= 0:
+                    b = 1 << bit
+                    t = self._repeat_ms[bit]
+                    if t <= 0:
+                        self._timing &= ~b
+                        self._held |= b
+                    if self._h_hold[bit]:
+                        self._h_hold[bit](bit)
+                self._t_hold[bit] = t
+            timing >>= 1
+            bit += 1
+
+    async def coro_check(self):
+        check_ms = self.check_ms
+        while True:
+            await aio.sleep_ms(check_ms)
+            changes = self.scan(self._read_port())
+            if changes:
+                self._dispatch(changes)
+            if self._timing:
+                self._tick_hold(check_ms)
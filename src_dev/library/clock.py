@@ -0,0 +1,107 @@
+'''
+Cached wall clock
+
+A snapshot of the local time kept in plain int attributes, so the schedule
+checks on the hot path are attribute reads instead of time.localtime() calls.
+The seconds of the day are advanced from time.time() every second, the date
+is only read back with time.localtime() on a day rollover or a sync.
+
+Call sync() after the RTC is set (i.e. BLE time sync).
+
+Usage:
+    from library.clock import clock
+    if sch[start] <= clock.seconds <= sch[end]:
+        ...
+'''
+import time
+import uasyncio as aio
+
+from library.logger import Log
+
+log = Log(__name__, Log.WARNING).get_logger()
+
+
+class Clock:
+
+    def __init__(self):
+        self.year = 0
+        self.month = 0
+        self.day = 0
+        self.weekday = 0  # 0 is Monday
+        self.hour = 0
+        self.minute = 0
+        self.second = 0
+        self.seconds = 0  # seconds from midnight
+        self._base_time = 0  # time.time() at the last sync
+        self._base_seconds = 0  # seconds from midnight at the last sync
+        self._minute_subscribers = []
+        self._day_subscribers = []
+        self.sync()
+
+    def subscribe_minute(self, callback):
+        '''
+        callback(clock) is called on every minute rollover and after a sync
+        '''
+        self._minute_subscribers.append(callback)
+
+    def subscribe_day(self, callback):
+        '''
+        callback(clock) is called on every day rollover and after a sync
+        '''
+        self._day_subscribers.append(callback)
+
+    def sync(self):
+        '''
+        Read the full date and time again, use after the RTC is set
+        '''
+        self._sync()
+        self._notify(self._minute_subscribers)
+        self._notify(self._day_subscribers)
+
+    def _sync(self):
+        # date and base time from the same time.time() reading
+        t = time.time()
+        dt = time.localtime(t)
+        self.year = dt[0]
+        self.month = dt[1]
+        self.day = dt[2]
+        self.weekday = dt[6]
+        self._base_time = t
+        self._base_seconds = dt[3] * 3600 + dt[4] * 60 + dt[5]
+        self._set_seconds(self._base_seconds)
+        log.debug("Clock synced: %d-%d-%d %d", self.year, self.month,
+                  self.day, self.seconds)
+
+    def _set_seconds(self, seconds):
+        self.seconds = seconds
+        self.hour = seconds // 3600
+        self.minute = (seconds // 60) % 60
+        self.second = seconds % 60
+
+    def update(self):
+        '''
+        Advance the snapshot to the current time, cheap enough to call before a check
+        '''
+        seconds = self._base_seconds + time.time() - self._base_time
+        if seconds == self.seconds:
+            return
+        if seconds >= 86400 or seconds < self._base_seconds:
+            # day rollover (or the time went backwards), read the date again
+            self.sync()
+            return
+        minute = seconds // 60 != self.seconds // 60
+        self._set_seconds(seconds)
+        if minute:
+            self._notify(self._minute_subscribers)
+
+    def _notify(self, subscribers):
+        for callback in subscribers:
+            callback(self)
+
+    async def tasks(self):
+        while True:
+            self.update()
+            await aio.sleep(1)
+
+
+clock = Clock()
@@ -0,0 +1,56 @@
+'''
+Cancellable countdown against the monotonic clock.
+The wait is a single wakeup at the deadline (or on cancel), so long jobs
+don't poll and don't drift.
+
+Usage:
+    refill = Countdown()
+    refill.reset()  # when the job is requested, so an early cancel is kept
+    ...
+    if await refill.run(minutes * 60):
+        ...  # elapsed
+    # elsewhere
+    refill.cancel()
+'''
+import time
+import uasyncio as aio
+
+
+class Countdown:
+
+    def __init__(self):
+        self._cancel = aio.Event()
+        self._deadline = None
+
+    def running(self):
+        return self._deadline is not None
+
+    def remaining_s(self):
+        '''
+        Seconds left, 0 when not running
+        '''
+        if self._deadline is None:
+            return 0
+        return max(0, time.ticks_diff(self._deadline, time.ticks_ms())) // 1000
+
+    def cancel(self):
+        self._cancel.set()
+
+    def reset(self):
+        '''
+        Clear a previous cancel, call when the job is requested
+        '''
+        self._cancel.clear()
+
+    async def run(self, seconds):
+        '''
+        Returns True when the time elapsed, False when cancelled (also before the start)
+        '''
+        self._deadline = time.ticks_add(time.ticks_ms(), seconds * 1000)
+        try:
+            await aio.wait_for_ms(self._cancel.wait(), seconds * 1000)
+            return False
+        except aio.TimeoutError:
+            return True
+        finally:
+            self._deadline = None
@@ -6,10 +6,13 @@ This can be used for both gas and heat pump.
 It should also be able to control solar heating with a bit of modification.
 """
 import uasyncio as aio
+import time
 
 from library.logger import Log
+from library import logring
 
 log = Log(__name__, Log.DEBUG).get_logger()
+ring_log = logring.RingLogger(logring.ring, __name__, Log.INFO)
 
 
 # a simple heating algorithm class
@@ -56,6 +59,10 @@ class Heater:
 
         self._target_centiC = 0
         self._enabled = False
+        self._temperature_centiC = None
+        self._temperature_ticks = 0
+        # called when the enable or the heater relay changes, i.e. to refresh the LEDs
+        self.changed = None
 
     async def tasks(self):
         last_state = True
@@ -67,43 +74,49 @@ class Heater:
                 log.debug('...............Heater LOOP...............')
                 await aio.sleep(1)
                 temperature = await self.get_rounded_temperature()
-                log.debug(f"Heater Temperature: {temperature/100}C")
+                log.debug("Heater Temperature: %dcC", temperature)
                 if temperature < self._target_centiC:
                     # await put system in particular heat mode?
                     log.debug('attempt to turn on')
                     if self._turn_on_if_possible():
-                        log.debug(
-                            f'turned on for {self._minimum_on_s} seconds')
+                        log.debug('turned on for %d seconds',
+                                  self._minimum_on_s)
                         await aio.sleep(self._minimum_on_s)
                 elif temperature > self._target_centiC + self._upper_tolerance_centiC:
                     # await put system in particular heat mode?
                     log.debug('attempt to turn off')
                     if self._turn_off_if_possible():
-                        log.debug(
-                            f'turned off for {self._off_period_s} seconds')
+                        log.debug('turned off for %d seconds',
+                                  self._off_period_s)
                         await aio.sleep(self._off_period_s)
             elif last_state:
                 last_state = False
                 log.debug('Heater is disabled.')
                 if self._turn_off_if_possible():
-                    log.warning(f'heater turned off')
+                    log.warning('heater turned off')
             await aio.sleep(1)
 
     async def enable(self):
-        log.debug(f'Heater is enabled.')
+        log.debug('Heater is enabled.')
         self._enabled = True
+        self._notify_changed()
         temperature = await self.get_rounded_temperature()
         if temperature < self._target_centiC:
             log.debug('attempt to turn on')
             if self._turn_on_if_possible():
-                log.warning(f'turned on for partial cycle')
+                log.warning('turned on for partial cycle')
 
     def disable(self):
         self._enabled = False
+        self._notify_changed()
         # disable the heater should be immediate, in case an on session is running
         log.debug('Heater is disabled.')
         if self._turn_off_if_possible():
-            log.warning(f'heater turned off')
+            log.warning('heater turned off')
+
+    def _notify_changed(self):
+        if self.changed is not None:
+            self.changed()
 
     def is_running(self):
         return (self._value() == 1)
@@ -116,18 +129,18 @@ class Heater:
         if temperature_centiC % self._round_steps == 0:
             valid = True
             self._target_centiC = temperature_centiC
-            log.debug(f"Target Temperature set to {temperature_centiC/100}C")
+            log.debug("Target Temperature set to %dcC", temperature_centiC)
         if valid and self.is_enabled():
             # NOTE: We do this to enforce the new temperature half way through the cycle
             temperature = await self.get_rounded_temperature()
             if temperature < self._target_centiC:
                 log.debug('Change of target temperature, attempt to turn on')
                 if self._turn_on_if_possible():
-                    log.warning(f'turned on for temp change')
+                    log.warning('turned on for temp change')
             elif temperature > self._target_centiC + self._upper_tolerance_centiC:
                 log.debug('Change of target temperature, attempt to turn off')
                 if self._turn_off_if_possible():
-                    log.warning(f'turned off for temp change')
+                    log.warning('turned off for temp change')
         return valid
 
     def get_target_temperature(self):
@@ -137,7 +150,12 @@ class Heater:
         # check valve position before turning on
         possible = True
         if possible:
+            was_on = self.is_running()
             self._turn_on()
+            if not was_on:
+                # only the switching, the heater loop calls this on every check
+                ring_log.info("heater on", self._target_centiC)
+                self._notify_changed()
         else:
             possible = False
         return possible
@@ -146,7 +164,11 @@ class Heater:
         # check valve position before turning off
         possible = True
         if possible:
+            was_on = self.is_running()
             self._turn_off()
+            if was_on:
+                ring_log.info("heater off", self._target_centiC)
+                self._notify_changed()
         else:
             possible = False
         return possible
@@ -173,4 +195,16 @@ class Heater:
             result = ((value + (step//2)) // step) * step
         else:
             result = ((value - (step//2)) // step) * step
+        self._temperature_centiC = result
+        self._temperature_ticks = time.ticks_ms()
         return result
+
+    async def get_shared_temperature(self, max_age_ms):
+        """
+        Return the last rounded temperature if it was sampled within max_age_ms,
+        otherwise sample it. Lets other consumers share the heater's sensor readings.
+        """
+        if (self._temperature_centiC is not None and
+                time.ticks_diff(time.ticks_ms(), self._temperature_ticks) < max_age_ms):
+            return self._temperature_centiC
+        return await self.get_rounded_temperature()
@@ -1,5 +1,6 @@
 import uasyncio as aio
 from micropython import const
+import sys
 import enums
 
 from library.logger import Log
@@ -74,26 +75,115 @@ class PoolLightColour:
     DaveyCode: Davey code for the colour
     ManufacturerName: Name of the colour specific to the manufacturer
     ManufacturerCode: Step or Time code for the colour specific to the manufacturer
+    Position: index of the colour in the manufacturer selection order, used for stepping
     '''
 
-    def __init__(self, DaveyCode, ManufacturerName, ManufacturerCode):
+    def __init__(self, DaveyCode, ManufacturerName, ManufacturerCode, Position=None):
         self.davey_code = DaveyCode
         self.name = ManufacturerName
         self.config_code = ManufacturerCode
+        self.position = Position
+
+
+# returned by LightControl.get_colour_object for codes the brand doesn't have
+NO_COLOUR = PoolLightColour(None, None, None)
+
+
+class ColourPlan:
+    '''
+    How LightControl.set_colour reaches a colour, refer to LightControl.plan
+    '''
+    NONE = const(0)  # already on the colour
+    TIMED = const(1)  # single off window of the colour time code (or reset and steps)
+    STEP = const(2)  # short off/on pulses, one per position
+
+
+class LightCommandQueue:
+    '''
+    Single slot command queue, the latest command wins.
+    A command put while another one is pending replaces it, and a running
+    colour change sees pending() and stops at the next pulse boundary:
+        await light.set_colour(colour, queue.pending)
+    Commands are (action, colour, status) tuples, the worker calls done() after each one
+    '''
+    OFF = const(0)
+    COLOUR = const(1)
+    SETUP = const(2)
+
+    def __init__(self):
+        self._command = None
+        self._flag = aio.ThreadSafeFlag()
+        self._idle = aio.Event()  # no command running
+        self._idle.set()
+        self._draining = False
+        self.coalesced = 0
+
+    def put(self, command):
+        if self._command is not None:
+            self.coalesced += 1
+        self._command = command
+        self._flag.set()
+
+    def pending(self):
+        return self._command is not None or self._draining
+
+    async def get(self):
+        while self._command is None:
+            await self._flag.wait()
+        command = self._command
+        self._command = None
+        self._idle.clear()
+        return command
+
+    def done(self):
+        '''
+        The command from get() is finished (or preempted)
+        '''
+        self._idle.set()
+
+    async def drain(self):
+        '''
+        Drop the pending command and wait for the running one, a running colour change is preempted
+        Returns True if a command was dropped or interrupted
+        '''
+        busy = self._command is not None or not self._idle.is_set()
+        self._command = None
+        self._draining = True
+        try:
+            await self._idle.wait()
+        finally:
+            self._draining = False
+        return busy
 
 
 class LightControl:
     # TODO: Implement the State class and use it to manage the state of the light and lock the state to prevent multiple changes while the light is changing
-    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms, on_ms,  colours: tuple[PoolLightColour, ...], synchronise, hold_ms=3000, setup=None, set_colour=None):
+    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms, on_ms,  colours: tuple[PoolLightColour, ...], synchronise, hold_ms=3000, setup=None, set_colour=None,
+                 step_off_ms=None, step_on_ms=None, positions=0, sequencer=None, reset_ms=None):
         '''
         hw_function_off: Function to turn the light off with a single call
         hw_function_on: Function to turn the light on with a single call
         hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
         adjust_steps: Function that returns a +/- int to adjust the number of steps required to reach the desired colour, if not needed it should just return 0
         synchronise: Function to synchronise the lights, as it is light dependent it needs to be defined in the calling code
+        step_off_ms, step_on_ms: off/on pulse that advances the light to the next position, None if the light can't step
+        positions: number of positions in the manufacturer selection order (including the skipped ones)
+        sequencer: library.pulse.PulseSequencer timing the single_switch pulses, aio.sleep_ms is used if None
+        reset_ms: off window that resets the light to position 0, for the lights without time codes
         '''
         self._colours = colours
+        # indexed by Davey code
+        self._by_code = [NO_COLOUR] * (max(c.davey_code for c in colours) + 1)
+        for colour in colours:
+            self._by_code[colour.davey_code] = colour
+        self._RESET_ms = reset_ms
         self._current_colour = None
+        self._STEP_OFF_ms = step_off_ms
+        self._STEP_ON_ms = step_on_ms
+        self._positions = positions
+        self.last_plan = (ColourPlan.NONE, 0, 0)
+        self._sequencer = sequencer
+        self.pulse_error_ms = 0  # of the last single_switch
         self.hw_on = hw_function_on
         self.hw_off = hw_function_off
         self.hw_check = hw_function_check
@@ -108,6 +198,13 @@ class LightControl:
     def value(self):
         return self.state
 
+    def sync_state(self):
+        '''
+        Take the state from the relay without switching it, the colour is unknown
+        '''
+        self.state = enums.Status.manualOn if self._check() else enums.Status.manualOff
+        self._current_colour = None
+
     async def on(self, hold_ms=None):
         await self._on(hold_ms)
         self.state = enums.Status.manualOn
@@ -117,19 +214,21 @@ class LightControl:
             hold_ms = self._HOLD_ms
         log.debug("hw_on")
         self.hw_on()
-        log.debug(f"wait for {hold_ms}ms")
+        log.debug("wait for %dms", hold_ms)
         await aio.sleep_ms(hold_ms)
 
     async def off(self, hold_ms=None):
         await self._off(hold_ms)
         self.state = enums.Status.manualOff
+        # the colour after a power cycle is brand dependent, the next change is timed
+        self._current_colour = None
 
     async def _off(self, hold_ms=None):
         if hold_ms is None:
             hold_ms = self._HOLD_ms
         log.debug("hw_off")
         self.hw_off()
-        log.debug(f"wait for {hold_ms}ms")
+        log.debug("wait for %dms", hold_ms)
         await aio.sleep_ms(hold_ms)
 
     async def toggle(self, hold_ms=None):
@@ -153,6 +252,15 @@ class LightControl:
             off_ms -= 10  # relay on has a 10ms delay, so we need to adjust the off_ms to compensate
         if on_ms is None:
             on_ms = self._ON_ms
+        if self._sequencer is not None:
+            if self._check() == False:
+                log.info("Light is off, turning on")
+                edges = ((self.hw_on, self._ON_ms), (self.hw_off, off_ms),
+                         (self.hw_on, on_ms))
+            else:
+                edges = ((self.hw_off, off_ms), (self.hw_on, on_ms))
+            self.pulse_error_ms = await self._sequencer.play(edges)
+            return
         if self._check() == False:
             log.info("Light is off, turning on")
             # NOTE: this may need to switch hold_ms for the lights that use NEXT
@@ -160,51 +268,96 @@ class LightControl:
         await self._off(off_ms)
         await self._on(on_ms)
 
-    # def _calculate_steps(self, Colour: PoolLightColour):
-    #     steps_required = Colour.code - self._current_colour.code
-    #     log.debug(steps_required)
-    #     if steps_required < 0:
-    #         steps_required = len(self._colours) + steps_required
-    #         log.debug(f"adjusted, -: {steps_required}")
-    #     return steps_required
-
     def colour(self):
         return self._current_colour
 
-    async def set_colour(self, Colour: PoolLightColour):
+    def forget_colour(self):
+        '''
+        The light was driven by something else (i.e. another brand object), the next change is timed
+        '''
+        self._current_colour = None
+
+    def plan(self, Colour: PoolLightColour):
+        '''
+        Return the fastest way to reach Colour as (ColourPlan, step pulses, estimated duration in ms)
+        Stepping needs the current colour, so it is only used while the light is on at a known colour.
+        Returns None for a colour the brand doesn't have (i.e. NO_COLOUR)
+        '''
+        if ((self._RESET_ms is None and Colour.config_code is None) or
+                (self._RESET_ms is not None and Colour.position is None)):
+            log.error("LIGHT colour is not available for this brand")
+            return None
+        if self._RESET_ms is None:
+            timed = (ColourPlan.TIMED, 0, Colour.config_code + self._ON_ms)
+        else:
+            timed = (ColourPlan.TIMED, Colour.position, self._RESET_ms + self._ON_ms +
+                     Colour.position * (self._STEP_OFF_ms + self._STEP_ON_ms))
+        current = self._current_colour
+        if current is None or not self._check():
+            return timed
+        if current is Colour:
+            return (ColourPlan.NONE, 0, 0)
+        if (self._STEP_OFF_ms is None or current.position is None or
+                Colour.position is None):
+            return timed
+        steps = (Colour.position - current.position) % self._positions
+        step_ms = steps * (self._STEP_OFF_ms + self._STEP_ON_ms)
+        if step_ms < timed[2]:
+            return (ColourPlan.STEP, steps, step_ms)
+        return timed
+
+    async def set_colour(self, Colour: PoolLightColour, preempt=None):
+        '''
+        preempt: function returning True when a newer command is waiting, checked before every pulse
+        Returns False if the change was preempted (the light is left at a safe pulse boundary)
+        '''
         if self._set_colour is None:
-            log.debug(f"LIGHT colour to {Colour.name}")
+            plan = self.plan(Colour)
+            if plan is None:
+                return True  # nothing to do, the light is left as it is
+            self.last_plan = plan
+            method, steps, duration_ms = plan
+            log.debug("LIGHT colour to %s, plan %d x%d %dms",
+                      Colour.name, method, steps, duration_ms)
             self.state = enums.Status.transition
-            log.debug(f"state: {self.state}")
-            await self.single_switch(Colour.config_code)
+            if method == ColourPlan.TIMED:
+                if preempt is not None and preempt():
+                    self.state = enums.Status.manualOn if self._check() else enums.Status.manualOff
+                    return False
+                if self._RESET_ms is None:
+                    await self.single_switch(Colour.config_code)
+                else:
+                    await self.single_switch(self._RESET_ms)
+                position = 0
+            elif method == ColourPlan.STEP:
+                position = self._current_colour.position
+            for _ in range(steps):
+                if preempt is not None and preempt():
+                    self._current_colour = self._colour_at(position)
+                    self.state = enums.Status.manualOn
+                    return False
+                await self.single_switch(self._STEP_OFF_ms, self._STEP_ON_ms)
+                position = (position + 1) % self._positions
             self._current_colour = Colour
             self.state = enums.Status.manualOn
         else:
             log.debug("Custom set_colour function defined")
             await self._set_colour(Colour)
-        # if self._current_colour is None:
-        #     log.debug("First time setting colour")
-        #     self.synchronise()
-        # log.debug(
-        #     f"Current colour is {self._current_colour.name}, {self._current_colour.code} --> Setting colour to {Colour.name}, {Colour.code}")
-        # steps_required = self._calculate_steps(Colour)
-        # log.debug(steps_required)
-        # if steps_required == 0:
-        #     log.debug("No change required")
-        #     return
-
-        # steps_required += self.adjust_steps()
-        # log.debug(steps_required)
-
-        # for _ in range(steps_required):
-        #     self.single_switch()
-        # self._current_colour = Colour
+        return True
 
-    def get_colour_object(self, davey_code: int):
+    def _colour_at(self, position):
+        '''
+        Colour at a position of the selection order, None for the skipped positions
+        '''
         for colour in self._colours:
-            if colour.davey_code == davey_code:
+            if colour.position == position:
                 return colour
-        return PoolLightColour(None, None, None)
+        return None
+
+    def get_colour_object(self, davey_code: int):
+        if 0 <= davey_code < len(self._by_code):
+            return self._by_code[davey_code]
+        return NO_COLOUR
 
     async def setup(self):
         if self._setup is not None:
@@ -219,136 +372,43 @@ class LightControl:
         return (self.state == enums.Status.transition)
 
 
-class SpaElectricColours:
+# Brand registry: brand code (int, as in the state store) -> (name, module, class)
+# The profile module (timings, colour table, setup) is only imported when the brand is selected
+BRANDS = {
+    enums.Light.Brands.SpaElectric[0]: ("Spa Electric", "library.lights_spa_electric", "SpaElectricColours"),
+    enums.Light.Brands.AquaQuip[0]: ("AquaQuip", "library.lights_aquaquip", "AquaQuipColours"),
+    enums.Light.Brands.Waterco[0]: ("Waterco", "library.lights_waterco", "WatercoColours"),
+}
+
+
+def brand_name(brand):
+    entry = BRANDS.get(brand)
+    return None if entry is None else entry[0]
+
+
+def load_brand(brand):
     '''
-    Spa Electric light control
-    The available colours and pattern (in order of selection) are:
-    1, Blue -> BLUE
-    2, Magenta -> PURPLE
-    3, Red -> RED
-    4, Lime -> YELLOW
-    5, Green -> GREEN
-    6, Aqua -> CYAN
-    7, White 1 -> WHITE
-    8, White 2 -> _skip
-    9, Slow colour blend -> SLOW
-    10, Fast colour change -> FAST
+    Import the brand profile and return its class, None for an unknown brand
     '''
-    blue = PoolLightColour(DaveyColourIndex.Blue, 'blue', 250)
-    purple = PoolLightColour(DaveyColourIndex.Purple, 'magenta', 300)
-    red = PoolLightColour(DaveyColourIndex.Red, 'red', 350)
-    yellow = PoolLightColour(DaveyColourIndex.Yellow, 'lime', 400)
-    green = PoolLightColour(DaveyColourIndex.Green, 'green', 450)
-    cyan = PoolLightColour(DaveyColourIndex.Cyan, 'aqua', 500)
-    white = PoolLightColour(DaveyColourIndex.White, 'white 1', 550)
-    slow = PoolLightColour(DaveyColourIndex.Slow, 'slow colour blend', 600)
-    fast = PoolLightColour(DaveyColourIndex.Fast, 'fast colour change', 650)
-
-    colours = (blue, purple, red, yellow, green, cyan, white, slow, fast)
-
-    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms=400, on_ms=120):
-        '''
-        hw_function_off: Function to turn the light off with a single call
-        hw_function_on: Function to turn the light on with a single call
-        hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
-        '''
-        self.light = LightControl(hw_function_off, hw_function_on, hw_function_check,
-                                  off_ms, on_ms, self.colours, self.synchronise, hold_ms=const(3_000), setup=self._setup)
-
-    async def synchronise(self):
-        await self.light.on()
-        await self.light.single_switch(220, 120)  # rapid on/off
-        # self.light.single_switch()  # off for 2s and then turn on
-        current_colour = self.light._current_colour
-        self.light._current_colour = self.colours[0]
-        if current_colour == None:
-            await self.light.set_colour(self.light._current_colour)
-        else:
-            await self.light.set_colour(current_colour)
-        return self.light._current_colour
-
-    async def _setup(self):
-        async def _enter_setting_mode(self):
-            log.debug("Entering setting mode")
-            log.debug("wait 30s...")
-            await self.light.off(30_000)
-            for _ in range(3):
-                log.debug("wait 12s...")
-                await self.light.single_switch(12_000, 1000)
-
-        async def _save_settings(self):
-            log.debug("Save settings")
-            log.debug("wait 31s...")
-            await self.light.single_switch(31_000, self.light._HOLD_ms)
-
-        async def _next_setting(self, count=1):
-            for _ in range(count):
-                log.debug("Next setting")
-                await self.light.single_switch(1000, self.light._HOLD_ms)
-        '''
-        Setup the light to the correct mode
-        This has to be called upon initial setup if SpaElectric is selected to ensure the light is in the correct mode.
-        '''
-        await _enter_setting_mode(self)
-        # go to "green" which is multi mode mode
-        await _next_setting(self)
-        await _save_settings(self)
+    entry = BRANDS.get(brand)
+    if entry is None:
+        return None
+    module = __import__(entry[1], None, None, (entry[2],))
+    return getattr(module, entry[2])
 
 
-class AquaQuipColours:
+def unload_brand(brand):
     '''
-    AquaQuip light control
-    The available colours and pattern (in order of selection) are:
-    1, Blue -> BLUE
-    2, Aqua -> CYAN
-    3, Green -> GREEN
-    4, Gold -> YELLOW
-    5, Magenta -> PURPLE
-    6, Red -> RED
-    7, White -> WHITE
-    8, Seaside Scroll -> _skip
-    9, Slow Scroll -> SLOW
-    10, Rapid Scroll -> FAST
-    11, Fireworks -> _skip
-    12, Disco Tech -> _skip
-    13, Flash -> _skip
+    Drop the brand profile module so its colour table can be collected
     '''
-
-    blue = PoolLightColour(DaveyColourIndex.Blue, 'Blue', 160)
-    cyan = PoolLightColour(DaveyColourIndex.Cyan, 'Aqua', 200)
-    green = PoolLightColour(DaveyColourIndex.Green, 'Green', 240)
-    yellow = PoolLightColour(DaveyColourIndex.Yellow, 'Gold', 290)
-    purple = PoolLightColour(DaveyColourIndex.Purple, 'Magenta', 350)
-    red = PoolLightColour(DaveyColourIndex.Red, 'Red', 420)
-    white = PoolLightColour(DaveyColourIndex.White, 'White', 510)
-    # SeasideScroll = PoolLightColour('_Skip', 610)
-    slow = PoolLightColour(DaveyColourIndex.Slow, 'Slow Scroll', 730)
-    fast = PoolLightColour(DaveyColourIndex.Fast, 'Rapid Scroll', 870)
-    # Fireworks = PoolLightColour('_Skip', 1040)
-    # DiscoTech = PoolLightColour('_Skip', 1240)
-    # Flash = PoolLightColour('_Skip', 1440)
-
-    colours = (blue, purple, red, yellow, green, cyan, white, slow, fast)
-
-    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms=400, on_ms=120):
-        '''
-        hw_function_off: Function to turn the light off with a single call
-        hw_function_on: Function to turn the light on with a single call
-        hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
-        '''
-        self.light = LightControl(hw_function_off, hw_function_on, hw_function_check,
-                                  off_ms, on_ms, self.colours, self.synchronise, hold_ms=const(1_500))
-
-    async def synchronise(self):
-        await self.light.on()
-        await self.light.single_switch(6_500)  # rapid on/off
-        current_colour = self.light._current_colour
-        self.light._current_colour = self.colours[0]
-        if current_colour == None:
-            await self.light.set_colour(self.light._current_colour)
-        else:
-            await self.light.set_colour(current_colour)
-        return self.light._current_colour
+    entry = BRANDS.get(brand)
+    if entry is None or entry[1] not in sys.modules:
+        return
+    del sys.modules[entry[1]]
+    package = sys.modules.get("library")
+    name = entry[1].split(".")[-1]
+    if package is not None and hasattr(package, name):
+        delattr(package, name)
 
 
 async def test_colour(light, colour: PoolLightColour, wait_ms=1000):
@@ -363,25 +423,20 @@ async def test():
 
     rel = dwp.pin_RELAY_Light
 
-    log.debug("Testing Spa Electric Colours")
-    check = SpaElectricColours(rel.off, rel.on, rel.value)
-    await test_colour(check, check.white, 1000)
-    await test_colour(check, check.blue, 1000)
-    await test_colour(check, check.green, 1000)
-    await test_colour(check, check.cyan, 1000)
-    await test_colour(check, check.purple, 1000)
-    await test_colour(check, check.red, 500)
-    await test_colour(check, check.yellow, 5000)
-
-    log.debug("Testing AquaQuip Colours")
-    check = AquaQuipColours(rel.off, rel.on, rel.value)
-    await test_colour(check, check.white, 1000)
-    await test_colour(check, check.blue, 1000)
-    await test_colour(check, check.green, 1000)
-    await test_colour(check, check.cyan, 1000)
-    await test_colour(check, check.purple, 1000)
-    await test_colour(check, check.red, 500)
-    await test_colour(check, check.yellow, 500)
+    for brand in (enums.Light.Brands.SpaElectric[0], enums.Light.Brands.AquaQuip[0]):
+        log.debug("Testing %s Colours", brand_name(brand))
+        check = load_brand(brand)(rel.off, rel.on, rel.value).light
+        # unknown codes (0 is black/off, 10 is past the table) are rejected, not sent
+        for code in (0, 10):
+            if check.plan(check.get_colour_object(code)) is not None:
+                log.error("Colour %d was not rejected", code)
+        for code, wait_ms in ((DaveyColourIndex.White, 1000), (DaveyColourIndex.Blue, 1000),
+                              (DaveyColourIndex.Green, 1000), (DaveyColourIndex.Cyan, 1000),
+                              (DaveyColourIndex.Purple, 1000), (DaveyColourIndex.Red, 500),
+                              (DaveyColourIndex.Yellow, 5000)):
+            await test_colour(check, check.get_colour_object(code), wait_ms)
+        check = None
+        unload_brand(brand)
 
 
 if __name__ == "__main__":
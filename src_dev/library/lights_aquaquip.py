@@ -0,0 +1,65 @@
+'''
+AquaQuip brand profile, loaded on demand by library.lights.load_brand
+'''
+from micropython import const
+
+from library.lights import PoolLightColour, LightControl, DaveyColourIndex
+
+
+class AquaQuipColours:
+    '''
+    AquaQuip light control
+    The available colours and pattern (in order of selection) are:
+    1, Blue -> BLUE
+    2, Aqua -> CYAN
+    3, Green -> GREEN
+    4, Gold -> YELLOW
+    5, Magenta -> PURPLE
+    6, Red -> RED
+    7, White -> WHITE
+    8, Seaside Scroll -> _skip
+    9, Slow Scroll -> SLOW
+    10, Rapid Scroll -> FAST
+    11, Fireworks -> _skip
+    12, Disco Tech -> _skip
+    13, Flash -> _skip
+    '''
+
+    blue = PoolLightColour(DaveyColourIndex.Blue, 'Blue', 160, 0)
+    cyan = PoolLightColour(DaveyColourIndex.Cyan, 'Aqua', 200, 1)
+    green = PoolLightColour(DaveyColourIndex.Green, 'Green', 240, 2)
+    yellow = PoolLightColour(DaveyColourIndex.Yellow, 'Gold', 290, 3)
+    purple = PoolLightColour(DaveyColourIndex.Purple, 'Magenta', 350, 4)
+    red = PoolLightColour(DaveyColourIndex.Red, 'Red', 420, 5)
+    white = PoolLightColour(DaveyColourIndex.White, 'White', 510, 6)
+    # SeasideScroll = PoolLightColour('_Skip', 610)
+    slow = PoolLightColour(DaveyColourIndex.Slow, 'Slow Scroll', 730, 8)
+    fast = PoolLightColour(DaveyColourIndex.Fast, 'Rapid Scroll', 870, 9)
+    # Fireworks = PoolLightColour('_Skip', 1040)
+    # DiscoTech = PoolLightColour('_Skip', 1240)
+    # Flash = PoolLightColour('_Skip', 1440)
+
+    colours = (blue, purple, red, yellow, green, cyan, white, slow, fast)
+
+    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms=400, on_ms=120, sequencer=None):
+        '''
+        hw_function_off: Function to turn the light off with a single call
+        hw_function_on: Function to turn the light on with a single call
+        hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
+        sequencer: optional library.pulse.PulseSequencer, refer to LightControl
+        '''
+        # NOTE: no step pulse until one is verified on hardware, every change uses the colour time code
+        self.light = LightControl(hw_function_off, hw_function_on, hw_function_check,
+                                  off_ms, on_ms, self.colours, self.synchronise, hold_ms=const(1_500),
+                                  positions=13, sequencer=sequencer)
+
+    async def synchronise(self):
+        await self.light.on()
+        await self.light.single_switch(6_500)  # rapid on/off
+        current_colour = self.light._current_colour
+        self.light._current_colour = self.colours[0]
+        if current_colour == None:
+            await self.light.set_colour(self.light._current_colour)
+        else:
+            await self.light.set_colour(current_colour)
+        return self.light._current_colour
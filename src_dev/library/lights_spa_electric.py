@@ -0,0 +1,88 @@
+'''
+Spa Electric brand profile, loaded on demand by library.lights.load_brand
+'''
+from micropython import const
+
+from library.lights import PoolLightColour, LightControl, DaveyColourIndex
+from library.logger import Log
+
+log = Log(__name__, Log.WARNING).get_logger()
+
+
+class SpaElectricColours:
+    '''
+    Spa Electric light control
+    The available colours and pattern (in order of selection) are:
+    1, Blue -> BLUE
+    2, Magenta -> PURPLE
+    3, Red -> RED
+    4, Lime -> YELLOW
+    5, Green -> GREEN
+    6, Aqua -> CYAN
+    7, White 1 -> WHITE
+    8, White 2 -> _skip
+    9, Slow colour blend -> SLOW
+    10, Fast colour change -> FAST
+    '''
+    blue = PoolLightColour(DaveyColourIndex.Blue, 'blue', 250, 0)
+    purple = PoolLightColour(DaveyColourIndex.Purple, 'magenta', 300, 1)
+    red = PoolLightColour(DaveyColourIndex.Red, 'red', 350, 2)
+    yellow = PoolLightColour(DaveyColourIndex.Yellow, 'lime', 400, 3)
+    green = PoolLightColour(DaveyColourIndex.Green, 'green', 450, 4)
+    cyan = PoolLightColour(DaveyColourIndex.Cyan, 'aqua', 500, 5)
+    white = PoolLightColour(DaveyColourIndex.White, 'white 1', 550, 6)
+    slow = PoolLightColour(DaveyColourIndex.Slow, 'slow colour blend', 600, 8)
+    fast = PoolLightColour(DaveyColourIndex.Fast, 'fast colour change', 650, 9)
+
+    colours = (blue, purple, red, yellow, green, cyan, white, slow, fast)
+
+    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms=400, on_ms=120, sequencer=None):
+        '''
+        hw_function_off: Function to turn the light off with a single call
+        hw_function_on: Function to turn the light on with a single call
+        hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
+        sequencer: optional library.pulse.PulseSequencer, refer to LightControl
+        '''
+        # NOTE: no step pulse until one is verified on hardware, every change uses the colour time code
+        self.light = LightControl(hw_function_off, hw_function_on, hw_function_check,
+                                  off_ms, on_ms, self.colours, self.synchronise, hold_ms=const(3_000), setup=self._setup,
+                                  positions=10, sequencer=sequencer)
+
+    async def synchronise(self):
+        await self.light.on()
+        await self.light.single_switch(220, 120)  # rapid on/off
+        # self.light.single_switch()  # off for 2s and then turn on
+        current_colour = self.light._current_colour
+        self.light._current_colour = self.colours[0]
+        if current_colour == None:
+            await self.light.set_colour(self.light._current_colour)
+        else:
+            await self.light.set_colour(current_colour)
+        return self.light._current_colour
+
+    async def _setup(self):
+        async def _enter_setting_mode(self):
+            log.debug("Entering setting mode")
+            log.debug("wait 30s...")
+            await self.light.off(30_000)
+            for _ in range(3):
+                log.debug("wait 12s...")
+                await self.light.single_switch(12_000, 1000)
+
+        async def _save_settings(self):
+            log.debug("Save settings")
+            log.debug("wait 31s...")
+            await self.light.single_switch(31_000, self.light._HOLD_ms)
+
+        async def _next_setting(self, count=1):
+            for _ in range(count):
+                log.debug("Next setting")
+                await self.light.single_switch(1000, self.light._HOLD_ms)
+        '''
+        Setup the light to the correct mode
+        This has to be called upon initial setup if SpaElectric is selected to ensure the light is in the correct mode.
+        '''
+        await _enter_setting_mode(self)
+        # go to "green" which is multi mode mode
+        await _next_setting(self)
+        await _save_settings(self)
@@ -0,0 +1,56 @@
+'''
+Waterco brand profile, loaded on demand by library.lights.load_brand
+'''
+from micropython import const
+
+from library.lights import PoolLightColour, LightControl, DaveyColourIndex
+
+
+class WatercoColours:
+    '''
+    Waterco light control
+    The light has no time codes, a short off/on steps to the next colour and
+    a long off resets it to the first one.
+    The available colours and pattern (in order of selection) are:
+    1, White -> WHITE
+    2, Slow changing colours -> SLOW
+    3, Fast changing colours -> FAST
+    4, Blue -> BLUE
+    5, Magenta -> PURPLE
+    6, Red -> RED
+    7, Yellow-Green (Gold) -> YELLOW
+    8, Green -> GREEN
+    9, Aqua -> CYAN
+    '''
+
+    white = PoolLightColour(DaveyColourIndex.White, 'White', 0, 0)
+    slow = PoolLightColour(DaveyColourIndex.Slow, 'Slow Changing Colours', 1, 1)
+    fast = PoolLightColour(DaveyColourIndex.Fast, 'Fast Changing Colours', 2, 2)
+    blue = PoolLightColour(DaveyColourIndex.Blue, 'Blue', 3, 3)
+    purple = PoolLightColour(DaveyColourIndex.Purple, 'Magenta', 4, 4)
+    red = PoolLightColour(DaveyColourIndex.Red, 'Red', 5, 5)
+    yellow = PoolLightColour(DaveyColourIndex.Yellow, 'Yellow-Green', 6, 6)
+    green = PoolLightColour(DaveyColourIndex.Green, 'Green', 7, 7)
+    cyan = PoolLightColour(DaveyColourIndex.Cyan, 'Aqua', 8, 8)
+
+    colours = (blue, purple, red, yellow, green, cyan, white, slow, fast)
+
+    def __init__(self, hw_function_off, hw_function_on, hw_function_check, off_ms=500, on_ms=1000, sequencer=None):
+        '''
+        hw_function_off: Function to turn the light off with a single call
+        hw_function_on: Function to turn the light on with a single call
+        hw_function_check: Function to check the state of the hardware pin, expecting a 0/1 or True/False and wrapping that internally to force True/False
+        sequencer: optional library.pulse.PulseSequencer, refer to LightControl
+        '''
+        self.light = LightControl(hw_function_off, hw_function_on, hw_function_check,
+                                  off_ms, on_ms, self.colours, self.synchronise, hold_ms=const(3_000),
+                                  step_off_ms=off_ms, step_on_ms=on_ms, positions=9, sequencer=sequencer,
+                                  reset_ms=const(15_000))
+
+    async def synchronise(self):
+        current_colour = self.light._current_colour
+        self.light._current_colour = None  # next change resets the light
+        if current_colour == None:
+            current_colour = self.white
+        await self.light.set_colour(current_colour)
+        return self.light._current_colour
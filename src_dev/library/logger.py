@@ -2,6 +2,15 @@ import logging
 
 
 class Log:
+    '''
+    Per module logger sharing a single StreamHandler.
+    The level is applied on the logger itself, so a disabled call returns
+    before a record is created or the message is formatted.
+    Use lazy arguments in hot loops, the message is only formatted when enabled:
+        log.debug("Heater Temperature: %d", temperature)
+    For code that must cost nothing in production wrap it in `if __debug__:`,
+    mpy-cross -O1 removes the whole block at compile time.
+    '''
     DEBUG = logging.DEBUG
     INFO = logging.INFO
     WARNING = logging.WARNING
@@ -11,16 +20,27 @@ class Log:
     _GLOBAL = DEBUG
     _DEFAULT = WARNING
 
+    _handler = None
+
     def __init__(self, name, level=None):
         if level is None:
             level = Log._DEFAULT
         self.log = logging.getLogger(name)
-        self.log.setLevel(Log._GLOBAL)
-        stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(level)
-        formatter = logging.Formatter("[%(levelname)s]:(%(name)s):%(message)s")
-        stream_handler.setFormatter(formatter)
-        self.log.addHandler(stream_handler)
+        self.log.setLevel(max(level, Log._GLOBAL))
+        handler = Log._get_handler()
+        if handler not in self.log.handlers:
+            self.log.addHandler(handler)
+
+    @staticmethod
+    def _get_handler():
+        if Log._handler is None:
+            handler = logging.StreamHandler()
+            handler.setLevel(Log._GLOBAL)
+            formatter = logging.Formatter(
+                "[%(levelname)s]:(%(name)s):%(message)s")
+            handler.setFormatter(formatter)
+            Log._handler = handler
+        return Log._handler
 
     def get_logger(self):
         return self.log
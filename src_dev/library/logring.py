@@ -0,0 +1,260 @@
+'''
+Binary log ring
+
+Compact log records kept in a preallocated RAM buffer and flushed to flash
+in batched writes from a low priority task, so logging on the hot path is a
+single struct.pack_into and the history survives a reboot.
+
+Record (13 bytes, little endian):
+    timestamp: u32 seconds (time.time())
+    module id: u16 (refer to the names file)
+    message id: u16 (refer to the names file)
+    level: u8
+    arg0, arg1: i16
+
+The id -> string table is loaded from a text file at boot and only new
+names are appended to it, so the records on flash can be decoded after a
+reboot. Ids are sequential, so two names never share one.
+
+REPL usage:
+    from library import logring
+    logring.dump()
+'''
+from micropython import const
+import struct
+import time
+import uasyncio as aio
+import os
+
+from library.logger import Log
+
+log = Log(__name__, Log.WARNING).get_logger()
+
+_RECORD_FMT = "<IHHBhh"
+_RECORD_SIZE = const(13)
+
+
+class LogRing:
+    LOG_FILE = "/log.bin"
+    OLD_LOG_FILE = "/log.old"
+    NAMES_FILE = "/log_names.txt"
+
+    def __init__(self, records=256, flush_records=64, flush_s=60, max_file_bytes=32_768):
+        '''
+        records: number of records kept in RAM
+        flush_records: number of pending records that triggers a flush
+        flush_s: maximum time before pending records are flushed
+        max_file_bytes: log file is rotated to LOG_FILE.old when it gets bigger than this
+        '''
+        self._records = records
+        self._buf = bytearray(records * _RECORD_SIZE)
+        self._mv = memoryview(self._buf)
+        self._head = 0  # next record slot
+        self._written = 0  # total records added
+        self._flushed = 0  # total records flushed (or dropped)
+        self.dropped = 0
+        self._flush_records = flush_records
+        self._flush_s = flush_s
+        self._max_file_bytes = max_file_bytes
+        self._names, complete = _load_names()  # name -> id
+        self._cut_line = not complete
+        # a names file from an older firmware can have hashed ids, skip them
+        self._used_ids = set(self._names.values())
+        self._next_id = 0
+        self._new_names = []
+        self._flush_event = aio.ThreadSafeFlag()
+
+    def name_id(self, name):
+        '''
+        Return the id for a module name or message string, registering it on first use
+        '''
+        i = self._names.get(name)
+        if i is None:
+            i = self._next_id
+            while i in self._used_ids:
+                i += 1
+            self._next_id = i + 1
+            self._used_ids.add(i)
+            self._names[name] = i
+            self._new_names.append(name)
+        return i
+
+    def add(self, level, module_id, msg_id, arg0=0, arg1=0):
+        struct.pack_into(_RECORD_FMT, self._buf, self._head * _RECORD_SIZE,
+                         time.time(), module_id, msg_id, level, arg0, arg1)
+        self._head += 1
+        if self._head >= self._records:
+            self._head = 0
+        self._written += 1
+        if self._written - self._flushed >= self._flush_records:
+            self._flush_event.set()
+
+    def pending(self):
+        return self._written - self._flushed
+
+    def records(self):
+        '''
+        Iterate over the records in RAM, oldest first, as tuples of
+        (timestamp, module id, message id, level, arg0, arg1)
+        '''
+        count = min(self._written, self._records)
+        index = (self._head - count) % self._records
+        for _ in range(count):
+            yield struct.unpack_from(_RECORD_FMT, self._buf, index * _RECORD_SIZE)
+            index = (index + 1) % self._records
+
+    def flush(self):
+        pending = self.pending()
+        if pending > self._records:
+            # the ring wrapped before a flush, the oldest records are lost
+            self.dropped += pending - self._records
+            pending = self._records
+        if self._new_names:
+            with open(self.NAMES_FILE, "a") as f:
+                if self._cut_line:
+                    f.write("\n")
+                    self._cut_line = False
+                for name in self._new_names:
+                    f.write("%d:%s\n" % (self._names[name], name))
+            self._new_names.clear()
+        if pending == 0:
+            return 0
+        self._rotate()
+        start = (self._head - pending) % self._records
+        with open(self.LOG_FILE, "ab") as f:
+            if start + pending <= self._records:
+                f.write(self._mv[start * _RECORD_SIZE:(start + pending) * _RECORD_SIZE])
+            else:
+                f.write(self._mv[start * _RECORD_SIZE:])
+                f.write(self._mv[:self._head * _RECORD_SIZE])
+        self._flushed = self._written
+        return pending
+
+    def _rotate(self):
+        try:
+            size = os.stat(self.LOG_FILE)[6]
+        except OSError:
+            return
+        if size >= self._max_file_bytes:
+            try:
+                os.remove(self.OLD_LOG_FILE)
+            except OSError:
+                pass
+            os.rename(self.LOG_FILE, self.OLD_LOG_FILE)
+
+    async def tasks(self):
+        while True:
+            try:
+                await aio.wait_for(self._flush_event.wait(), self._flush_s)
+            except aio.TimeoutError:
+                pass
+            try:
+                self.flush()
+            except OSError as e:
+                log.error("Log flush failed: %s", e)
+
+
+class RingLogger:
+    '''
+    Module scoped front end for the log ring.
+    msg is a constant string used as message id, the args are small ints:
+        ring_log.info("Heater on", temperature)
+    '''
+
+    def __init__(self, ring: LogRing, name, level=None):
+        if level is None:
+            level = Log._DEFAULT
+        self._ring = ring
+        self._module_id = ring.name_id(name)
+        self.level = level
+
+    def log(self, level, msg, arg0=0, arg1=0):
+        if level >= self.level:
+            self._ring.add(level, self._module_id,
+                           self._ring.name_id(msg), arg0, arg1)
+
+    def debug(self, msg, arg0=0, arg1=0):
+        self.log(Log.DEBUG, msg, arg0, arg1)
+
+    def info(self, msg, arg0=0, arg1=0):
+        self.log(Log.INFO, msg, arg0, arg1)
+
+    def warning(self, msg, arg0=0, arg1=0):
+        self.log(Log.WARNING, msg, arg0, arg1)
+
+    def error(self, msg, arg0=0, arg1=0):
+        self.log(Log.ERROR, msg, arg0, arg1)
+
+    def critical(self, msg, arg0=0, arg1=0):
+        self.log(Log.CRITICAL, msg, arg0, arg1)
+
+
+def _load_names():
+    '''
+    Return the names file as {name: id}, and False if its last line was cut short by a reset
+    '''
+    names = {}
+    complete = True
+    try:
+        with open(LogRing.NAMES_FILE) as f:
+            for line in f:
+                complete = line.endswith("\n")
+                i, sep, name = line.rstrip("\n").partition(":")
+                if not complete or not sep:
+                    continue
+                try:
+                    names[name] = int(i)
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return names, complete
+
+
+def _read_file(path):
+    try:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(_RECORD_SIZE)
+                if len(data) < _RECORD_SIZE:
+                    break
+                yield struct.unpack(_RECORD_FMT, data)
+    except OSError:
+        pass
+
+
+def dump(flash=True, ram=True):
+    '''
+    Print the log history, flash records first then the ones still in RAM
+    '''
+    # the ring loaded the names file at boot
+    names = {i: name for name, i in ring._names.items()}
+    sources = []
+    if flash:
+        sources.append(_read_file(LogRing.OLD_LOG_FILE))
+        sources.append(_read_file(LogRing.LOG_FILE))
+    if ram:
+        # records already flushed are printed from flash
+        sources.append(_pending_records() if flash else ring.records())
+    for source in sources:
+        for ts, module_id, msg_id, level, arg0, arg1 in source:
+            dt = time.localtime(ts)
+            print("%04d-%02d-%02d %02d:%02d:%02d [%d]:(%s):%s %d %d" % (
+                dt[0], dt[1], dt[2], dt[3], dt[4], dt[5], level,
+                names.get(module_id, module_id), names.get(msg_id, msg_id),
+                arg0, arg1))
+
+
+def _pending_records():
+    '''
+    Records in RAM that have not been flushed yet
+    '''
+    skip = min(ring._written, ring._records) - min(ring.pending(), ring._records)
+    for record in ring.records():
+        if skip > 0:
+            skip -= 1
+            continue
+        yield record
+
+
+ring = LogRing()
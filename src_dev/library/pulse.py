@@ -0,0 +1,111 @@
+'''
+Relay pulse sequencer
+
+Runs a train of relay edges woken by a one-shot timer instead of aio.sleep_ms,
+so a busy event loop (ZCD wait, NeoPixel write, I2C) does not stretch the
+off/on windows the lights decode as colours.
+Each edge is scheduled from the start of the train, so a late edge does not
+push the following ones, and the error of every edge is measured.
+The timer callback only sets a flag, the edges run in the playing task as the
+relay functions can block (i.e. the zero cross wait of the lights relay).
+
+Without machine.Timer (i.e. on the host) a task based timer with the same
+interface is used.
+
+Usage:
+    sequencer = PulseSequencer()
+    error_ms = await sequencer.play(((relay.off, 400), (relay.on, 120)))
+'''
+import time
+import uasyncio as aio
+
+from library.logger import Log
+
+log = Log(__name__, Log.WARNING).get_logger()
+
+try:
+    from machine import Timer
+except ImportError:
+    Timer = None
+
+
+class _TaskTimer:
+    '''
+    machine.Timer stand-in running the callback from a task
+    '''
+    ONE_SHOT = 0
+
+    def __init__(self, id=-1):
+        self._task = None
+
+    def init(self, mode=ONE_SHOT, period=0, callback=None):
+        self.deinit()
+        self._task = aio.create_task(self._run(period, callback))
+
+    async def _run(self, period, callback):
+        await aio.sleep_ms(period)
+        self._task = None
+        callback(self)
+
+    def deinit(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class PulseSequencer:
+
+    def __init__(self, timer_id=0, tolerance_ms=20):
+        '''
+        timer_id: hardware timer used for the one-shot callbacks
+        tolerance_ms: edges later than this are reported as a warning
+        '''
+        self._timer = Timer(timer_id) if Timer is not None else _TaskTimer()
+        self._one_shot = self._timer.ONE_SHOT
+        self._tolerance_ms = tolerance_ms
+        self._start = 0
+        self._wake = aio.ThreadSafeFlag()
+        self._busy = False
+        self.max_error_ms = 0  # of the last train
+        self.trains = 0
+        self.late_trains = 0
+
+    def busy(self):
+        return self._busy
+
+    async def play(self, edges):
+        '''
+        edges: sequence of (function, ms to wait after calling it)
+        Returns the largest edge error of the train in ms
+        '''
+        if self._busy:
+            raise RuntimeError("PulseSequencer is busy")
+        if not edges:
+            return 0
+        self._busy = True
+        self.max_error_ms = 0
+        deadline = 0  # of the next edge, from the start of the train
+        self._start = time.ticks_ms()
+        try:
+            for func, wait_ms in edges:
+                func()
+                error = time.ticks_diff(time.ticks_ms(), self._start) - deadline
+                if error > self.max_error_ms:
+                    self.max_error_ms = error
+                deadline += wait_ms
+                delay = deadline - time.ticks_diff(time.ticks_ms(), self._start)
+                self._wake.clear()
+                self._timer.init(mode=self._one_shot, period=max(1, delay),
+                                 callback=self._on_timer)
+                await self._wake.wait()
+        finally:
+            self._timer.deinit()
+            self._busy = False
+        self.trains += 1
+        if self.max_error_ms > self._tolerance_ms:
+            self.late_trains += 1
+            log.warning("Pulse train late by %dms", self.max_error_ms)
+        return self.max_error_ms
+
+    def _on_timer(self, timer):
+        self._wake.set()
@@ -40,8 +40,11 @@ Config: particular config for the schedule which is module specific
 # schedule class will have the following class attributes
 # _time_format
 # _time_format will be the time format for the schedule
-import time
+import struct
+import uasyncio as aio
+from micropython import const
 from library.logger import Log
+from library.clock import clock
 
 log = Log(__name__, Log.DEBUG).get_logger()
 
@@ -124,8 +127,7 @@ class Schedule:
         '''
         if self.is_enabled():
             if self._is_today_a_schedule_day(self._day_of_week):
-                current_time = self._datetime_to_seconds(time.localtime())
-                if self._start <= current_time <= self._end:
+                if self._start <= clock.seconds <= self._end:
                     self._is_running = True
         else:
             self._is_running = False
@@ -152,6 +154,152 @@ class Schedule:
         5: Saturday
         6: Sunday
         '''
-        today = time.localtime()[6]
-        log.debug(f'Today: {today}, DOW: {dow}, Bitwise: {1 << today}')
+        today = clock.weekday
+        log.debug('Today: %d, DOW: %d', today, dow)
         return (1 << today) & dow
+
+
+# Binary wire format
+# version: u8, start: u32, end: u32, dow: u8, enabled: u8, config: u8, heat_mode: u8
+# start and end are seconds from midnight, unpacked tuples follow enums.ScheduleIndex
+SCHEDULE_VERSION = const(1)
+SCHEDULE_SIZE = const(13)
+_SCHEDULE_FMT = "<BIIBBBB"
+_SCHEDULE_FIELDS_FMT = "<IIBBBB"
+
+
+def pack(start, end, dow, enabled, config=0, heat_mode=0):
+    '''
+    Return the binary wire format of a schedule
+    '''
+    return struct.pack(_SCHEDULE_FMT, SCHEDULE_VERSION,
+                       start, end, dow, enabled, config, heat_mode)
+
+
+# returned for an invalid value when there is no last good one
+DISABLED = (0, 0, 0, 0, 0, 0)
+
+
+def unpack(value, default=DISABLED):
+    '''
+    Return the schedule tuple (start, end, dow, enabled, config, heat_mode) from a characteristic value
+    Legacy ASCII schedules ("18000,25200,127,0,5") are still accepted during the app migration,
+    they never start with the version byte as it is not an ASCII digit.
+    default: returned (i.e. the last good schedule) when the value is invalid, it is logged instead of raised
+    '''
+    if len(value) == SCHEDULE_SIZE and value[0] == SCHEDULE_VERSION:
+        return struct.unpack_from(_SCHEDULE_FIELDS_FMT, value, 1)
+    if value and all(48 <= c <= 57 or c == 44 for c in value):  # ASCII digits and commas
+        schedule = from_legacy_string(bytes(value).decode())
+        if schedule is not None:
+            return schedule
+    else:
+        log.error("Invalid Schedule: version %d, %d bytes", value[0] if value else -1, len(value))
+    return default
+
+
+def from_legacy_string(string):
+    '''
+    expected schedule string format:
+    start, end, dow, enabled, [config], [mode]
+    Returns the schedule tuple with the optional fields as 0, None if the string is invalid
+    '''
+    try:
+        schedule = tuple(int(i) for i in string.split(','))
+    except ValueError:
+        schedule = ()
+    if len(schedule) not in (4, 5, 6):
+        log.error("Invalid Schedule String: %s", string)
+        return None
+    return schedule + (0,) * (6 - len(schedule))
+
+
+def next_edge_s(schedules, weekday, seconds):
+    '''
+    Return the seconds until the next start or end of any enabled schedule, None if there is none
+    schedules: iterable of schedule tuples (refer to unpack)
+    weekday: today, 0 is Monday
+    seconds: current time as seconds from midnight
+    '''
+    best = None
+    for sch in schedules:
+        if not sch[3]:  # enabled
+            continue
+        dow = sch[2]
+        # the schedule runs from start to end inclusive, so it stops at end + 1
+        for edge in (sch[0], sch[1] + 1):
+            for day in range(8):
+                if not dow & (1 << ((weekday + day) % 7)):
+                    continue
+                delta = day * 86400 + edge - seconds
+                if delta > 0:
+                    if best is None or delta < best:
+                        best = delta
+                    break
+    return best
+
+
+class ScheduleService:
+    '''
+    Wakes at the next schedule start/end instead of polling the schedules.
+    The next edge is armed on an alarm (i.e. PCF85063A.set_alarm) and the task waits for the
+    alarm interrupt flag, with a timer as backup (or as the only source when there is no alarm pin).
+    Controllers compare edge_count with their last seen value to re-evaluate their schedules,
+    on_edge(edge_count) lets them be woken (i.e. a library.state slot) instead of polling it.
+    '''
+
+    def __init__(self, get_schedules, set_alarm=None, clear_alarm=None, alarm_flag=None, on_edge=None):
+        '''
+        get_schedules: function returning an iterable of schedule tuples
+        set_alarm: function(hour, minute, second) arming the alarm, optional
+        clear_alarm: function clearing the alarm flag, optional
+        alarm_flag: asyncio.ThreadSafeFlag set by the alarm interrupt, optional
+        on_edge: function(edge_count) called on every edge, optional
+        '''
+        self._get_schedules = get_schedules
+        self._set_alarm = set_alarm
+        self._clear_alarm = clear_alarm
+        self._flag = alarm_flag if alarm_flag is not None else aio.ThreadSafeFlag()
+        self._on_edge = on_edge
+        self._rearm = False
+        self.edge_count = 0
+        self.next_edge_s = None
+
+    def rearm(self):
+        '''
+        Schedules changed, compute and arm the next edge again
+        '''
+        self._rearm = True
+        self._flag.set()
+
+    def _arm(self):
+        clock.update()
+        seconds = clock.seconds
+        delta = next_edge_s(self._get_schedules(), clock.weekday, seconds)
+        self.next_edge_s = delta
+        if delta is not None and self._set_alarm is not None:
+            edge = (seconds + delta) % 86400
+            self._set_alarm(edge // 3600, (edge // 60) % 60, edge % 60)
+        return delta
+
+    async def tasks(self):
+        while True:
+            delta = self._arm()
+            log.debug("Next schedule edge in %s s", delta)
+            try:
+                if delta is None:
+                    await self._flag.wait()
+                else:
+                    # backup timer in case the alarm interrupt is missed
+                    await aio.wait_for(self._flag.wait(), delta + 1)
+            except aio.TimeoutError:
+                pass
+            if self._clear_alarm is not None:
+                self._clear_alarm()
+            clock.update()
+            if self._rearm:
+                self._rearm = False
+                continue
+            self.edge_count += 1
+            if self._on_edge is not None:
+                self._on_edge(self.edge_count)
@@ -0,0 +1,85 @@
+'''
+Central controller state
+
+Fixed slots of small ints and schedule tuples (refer to enums.Slot) with a version counter per
+slot and for the whole store. Reads are a list access, and changes are
+pushed to the subscribers instead of every module polling the BLE
+characteristics.
+
+Usage:
+    from library.state import state
+    if state.get(Slot.slot_lights_mode) == enums.Modes.ManualOn[0]:
+        ...
+    state.set(Slot.slot_lights_status, enums.Status.manualOn[0])
+    state.subscribe(callback, (Slot.slot_heat_mode, Slot.slot_heat_status))
+    version = await state.wait(version, 100)
+'''
+import uasyncio as aio
+import enums
+
+
+class StateStore:
+
+    def __init__(self, slots):
+        self._values = [0] * slots
+        self._versions = [0] * slots
+        self._subscribers = [None] * slots  # per slot list of callbacks
+        self._event = aio.Event()  # set on every change, refer to wait
+        self.version = 0
+
+    def get(self, slot):
+        return self._values[slot]
+
+    def slot_version(self, slot):
+        return self._versions[slot]
+
+    def set(self, slot, value, source=None):
+        '''
+        Set a slot and notify its subscribers with callback(slot, value, source)
+        source: whoever made the change, so a binding can skip its own changes
+        Returns False when the value is unchanged (nothing is notified)
+        '''
+        if self._values[slot] == value:
+            return False
+        self._values[slot] = value
+        self._versions[slot] += 1
+        self.version += 1
+        subscribers = self._subscribers[slot]
+        if subscribers is not None:
+            for callback in subscribers:
+                callback(slot, value, source)
+        # wakes every waiter, a waiter clears it again when it is stale
+        self._event.set()
+        return True
+
+    def subscribe(self, callback, slots=None):
+        '''
+        slots: iterable of slots, None for all of them
+        '''
+        if slots is None:
+            slots = range(len(self._values))
+        for slot in slots:
+            if self._subscribers[slot] is None:
+                self._subscribers[slot] = []
+            self._subscribers[slot].append(callback)
+
+    async def wait(self, version, timeout_ms=None):
+        '''
+        Wait until the store version is different from version (or the timeout)
+        Returns the current version
+        '''
+        event = self._event
+        if self.version == version:
+            # set() already woke everyone waiting on it, so a set event is only stale
+            event.clear()
+            if timeout_ms is None:
+                await event.wait()
+            else:
+                try:
+                    await aio.wait_for_ms(event.wait(), timeout_ms)
+                except aio.TimeoutError:
+                    pass
+        return self.version
+
+
+state = StateStore(enums.Slot.slot_count)
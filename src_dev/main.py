@@ -1,15 +1,23 @@
 from relay_manager import RelayManager
 from valves_manager import ValveManager
+from plant_manager import Plant, PlantManager
 
 from machine import Pin, ADC, I2C
 from library.heater import Heater
+from library import schedule
 from math import log as LOG
 import ble_manager
 import uasyncio as aio
 import ui_manager
 import time
 import enums
+from enums import Slot
 from library.logger import Log
+from library import logring
+from library.clock import clock
+from library.countdown import Countdown
+from library.state import state
+from drivers.pcf85063a import get_pcf
 
 
 log = Log(__name__, Log.DEBUG).get_logger()
@@ -137,40 +145,7 @@ class Pixels:
 
 async def demo_ble():
     log.warning("Starting Demo...")
-    # add default value for all characteristics
-    # light:
-    # 18000/60/60, 25200 -> 5am, 7am
-    ble.update_char(ble.lights_schedule1_char, "18000,25200,127,0,5")
-    ble.update_char(ble.lights_schedule2_char, "64800,72000,127,0,7")
-    ble.update_char(ble.lights_manual_config_char, bytes(
-        [enums.Light.ColourCode.Yellow]))  # Yellow
-    ble.update_char(ble.lights_mode_char, enums.Modes.ManualOff)
-    ble.update_char(ble.lights_status_char, enums.Status.manualOff)
-    # water feature:
-    ble.update_char(ble.wf_schedule1_char, "18000,25200,127,0,5")
-    ble.update_char(ble.wf_schedule2_char, "64800,72000,127,0,7")
-    ble.update_char(ble.wf_mode_char, enums.Modes.ManualOff)
-    ble.update_char(ble.wf_status_char, enums.Status.manualOff)
-    # heat:
-    ble.update_char(ble.heat_schedule1_char, "46800,64800,127,0,30,1")
-    ble.update_char(ble.heat_schedule2_char, "64800,68400,127,0,38,2")
-    ble.update_char(ble.heat_manual_config_char, bytes(
-        [0x1C, 0x28]))  # 28C pool, 40C spa
-    ble.update_char(ble.heat_mode_char, enums.Modes.ManualOff)
-    ble.update_char(ble.heat_status_char, enums.Status.manualOff)
-    # garden light:
-    ble.update_char(ble.gl_schedule1_char, "18000,25200,127,0,5")
-    ble.update_char(ble.gl_schedule2_char, "64800,72000,127,0,7")
-    ble.update_char(ble.gl_mode_char, enums.Modes.ManualOff)
-    ble.update_char(ble.gl_status_char, enums.Status.manualOff)
-    # spa refill
-    ble.update_char(ble.spa_refill_manual_config_char, bytes([1]))  # minutes
-    ble.update_char(ble.spa_refill_mode_char, enums.Modes.ManualOff)
-    ble.update_char(ble.spa_refill_status_char, enums.Status.manualOff)
-    # config:
-    ble.update_char(ble.lights_brand_char, enums.Light.Brands.SpaElectric)
-    # status:
-    ble.update_char(ble.water_temperature_char, "...")
+    # NOTE: default values for all characteristics are set by the ble_manager GATT schema
 
     while True:
         if ble.is_connected():
@@ -189,24 +164,24 @@ async def demo_neopixel_lights(np: Pixels):
         return neo_index
 
     def get_ble_colour():
-        return ble.lights_manual_config_char.read()[0]
+        return state.get(Slot.slot_lights_colour)
 
     colours_length = len(Pixels.colours_list)-2  # -2 for slow and fast
     last_colour = enums.Light.ColourCode.Black
     transition_delay = const(500)
     while True:
         set_colour = get_ble_colour()
-        current_status = ble.lights_status_char.read()
+        current_status = state.get(Slot.slot_lights_status)
         if last_colour != set_colour:
-            log.info(f"Colour Updated:{set_colour}")
+            log.info("Colour Updated:%d", set_colour)
             last_colour = set_colour
             neo_index = set_colour
 
-        if current_status == enums.Status.transition:
+        if current_status == enums.Status.transition[0]:
             np.breath_list[np.nameIndex.Light] = True
             await aio.sleep_ms(transition_delay)
-        elif (current_status == enums.Status.manualOff or
-              current_status == enums.Status.scheduleOff):
+        elif (current_status == enums.Status.manualOff[0] or
+              current_status == enums.Status.scheduleOff[0]):
             np.clear(np.nameIndex.Light)
             await aio.sleep_ms(transition_delay)
         else:
@@ -223,7 +198,7 @@ async def demo_neopixel_lights(np: Pixels):
                 steps = const(30)
                 delay = const(166)  # delay is 5000/steps
                 for step in range(steps + 1):
-                    if (ble.lights_mode_char.read() == enums.Modes.ManualOff or
+                    if (state.get(Slot.slot_lights_mode) == enums.Modes.ManualOff[0] or
                             get_ble_colour() != enums.Light.ColourCode.Slow):
                         break
                     blend_factor = step / steps
@@ -244,142 +219,163 @@ async def demo_neopixel_lights(np: Pixels):
 
 async def demo_lights(relays: RelayManager):
     from library import lights
+    from library.pulse import PulseSequencer
     global light_transition
-    aq = relays.Lights
-    se = relays.Lights
-    lightSE = lights.SpaElectricColours(
-        se.off, se.on, se.value)
-    lightAQ = lights.AquaQuipColours(
-        aq.off, aq.on, aq.value)
+    # a brand switch creates a new light on the same relay, so the sequencer is shared
+    sequencer = PulseSequencer()
 
-    await lightSE.light.off()
-    await lightAQ.light.off()
-
-    light = lightSE
+    def make_light(brand):
+        '''
+        Load and create the selected brand only, its state is taken from the relay
+        '''
+        log.warning("Brand: %s", lights.brand_name(brand))
+        light = lights.load_brand(brand)(relays.Lights.off, relays.Lights.on,
+                                         relays.Lights.value, sequencer=sequencer)
+        light.light.sync_state()
+        return light
+
+    # NOTE: the relay is already off from RelayManager.all_off, no need to hold it off here
+    last_brand = state.get(Slot.slot_lights_brand)
+    if last_brand not in lights.BRANDS:
+        last_brand = enums.Light.Brands.SpaElectric[0]
+    light = make_light(last_brand)
     light_transition = light.light.is_transitioning
+    commands = lights.LightCommandQueue()
+
+    async def light_worker():
+        '''
+        Run the light commands, a newer command preempts a colour change at the next pulse
+        '''
+        while True:
+            action, colour, status = await commands.get()
+            try:
+                state.set(Slot.slot_lights_status, enums.Status.transition[0])
+                if action == commands.OFF:
+                    await light.light.off()
+                elif action == commands.SETUP:
+                    await light.light.setup()
+                elif not await light.light.set_colour(colour, commands.pending):
+                    log.debug("Lights colour change preempted")
+                    continue
+                if not commands.pending():
+                    state.set(Slot.slot_lights_status, status)
+            except Exception as e:
+                # keep the worker for the next command, the light is taken back from the relay
+                log.error("Lights command %d failed: %s", action, e)
+                light.light.sync_state()
+                state.set(Slot.slot_lights_status, light.light.state[0])
+            finally:
+                commands.done()
+
+    aio.create_task(light_worker())
+
+    def put_colour(code, status):
+        colour = light.light.get_colour_object(code)
+        if colour is lights.NO_COLOUR:
+            log.error("Lights colour %d is not available for this brand", code)
+            return
+        commands.put((commands.COLOUR, colour, status))
 
     last_colour = enums.Light.ColourCode.Black
-    last_mode = enums.Modes.ManualOff
-    last_brand = enums.Light.Brands.SpaElectric
+    last_mode = enums.Modes.ManualOff[0]
     last_sch1 = (0, 0, 0, 0, 0)
+    last_edge = 0
     last_sch2 = (0, 0, 0, 0, 0)
     while True:
-        ble_colour = ble.lights_manual_config_char.read()[0]
-        current_mode = ble.lights_mode_char.read()
-        brand = ble.lights_brand_char.read()
+        version = state.version
+        ble_colour = state.get(Slot.slot_lights_colour)
+        current_mode = state.get(Slot.slot_lights_mode)
+        brand = state.get(Slot.slot_lights_brand)
         if brand != last_brand:
-            if brand == enums.Light.Brands.SpaElectric:
+            if brand in lights.BRANDS:
+                # the worker and the sequencer must be done with the old light before it is dropped
+                if await commands.drain():
+                    last_mode = None  # put the dropped command again for the new light
+                while sequencer.busy():
+                    await aio.sleep_ms(20)
+                light = None
+                lights.unload_brand(last_brand)
                 last_brand = brand
-                log.warning("Brand: Spa Electric")
-                light = lightSE
-            elif brand == enums.Light.Brands.AquaQuip:
-                last_brand = brand
-                log.warning("Brand: AquaQuip")
-                light = lightAQ
-            elif brand == enums.Light.Brands.SETUP:
+                light = make_light(brand)
+            elif brand == enums.Light.Brands.SETUP[0]:
                 log.warning("Light Setup/Config")
-                await light.light.setup()
-                ble.lights_brand_char.write(last_brand)
+                commands.put((commands.SETUP, None, enums.Status.manualOff[0]))
+                state.set(Slot.slot_lights_brand, last_brand)
                 brand = last_brand
             light_transition = light.light.is_transitioning
-        if light_transition():
-            np.breath_list[np.nameIndex.Light] = True
-        else:
-            np.breath_list[np.nameIndex.Light] = False
-            if current_mode == enums.Modes.ManualOff:
-                if last_mode != current_mode:
-                    log.debug("Lights Manual Off")
-                    last_mode = current_mode
-                    ble.update_char(ble.lights_status_char,
-                                    enums.Status.transition)
-                    await light.light.off()
-                    ble.update_char(ble.lights_status_char,
-                                    enums.Status.manualOff)
-            elif current_mode == enums.Modes.ManualOn:
-                if last_mode != current_mode or last_colour != ble_colour:
-                    log.debug("Lights Manual On")
-                    last_mode = current_mode
-                    colour = light.light.get_colour_object(ble_colour)
-                    if last_colour != ble_colour:
-                        log.info(f"Lights Colour Updated: {colour.name}")
-                        last_colour = ble_colour
-                    np.breath_list[np.nameIndex.Light] = True
-                    # NOTE: set_colour is has a check to turn on lights if they are off
-                    ble.update_char(ble.lights_status_char,
-                                    enums.Status.transition)
-                    await light.light.set_colour(colour)
-                    ble.update_char(ble.lights_status_char,
-                                    enums.Status.manualOn)
-                    np.breath_list[np.nameIndex.Light] = False
-            elif current_mode == enums.Modes.Auto:
-                sch1 = schedule_from_string(
-                    ble.lights_schedule1_char.read().decode())
-                sch2 = schedule_from_string(
-                    ble.lights_schedule2_char.read().decode())
-                if sch1 != last_sch1 or sch2 != last_sch2:
-                    last_sch1 = sch1
-                    last_sch2 = sch2
-                    last_mode = enums.Modes.ManualOff  # force update
-                    log.info("Lights Schedule Updated")
-                if last_mode != current_mode:
-                    last_mode = current_mode
-                    log.debug("Lights Auto")
-                    if not (sch1[enums.ScheduleIndex.enabled] and
-                            sch2[enums.ScheduleIndex.enabled]):
-                        log.warning(
-                            "Auto light mode but both schedules are disabled")
-                    if schedule_is_running(sch1) and schedule_is_running(sch2):
-                        log.warning("Schedules are overlapping")
-                    if schedule_is_running(sch1):
-                        log.info("Lights Auto 1 ON")
-                        colour = light.light.get_colour_object(
-                            sch1[enums.ScheduleIndex.config])
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.transition)
-                        await light.light.set_colour(colour)
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.schedule1On)
-                    elif schedule_is_running(sch2):
-                        log.info("Lights Auto 2 ON")
-                        colour = light.light.get_colour_object(
-                            sch2[enums.ScheduleIndex.config])
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.transition)
-                        await light.light.set_colour(colour)
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.schedule2On)
-                    else:
-                        log.info("Lights Auto Off")
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.transition)
-                        await light.light.off()
-                        ble.update_char(ble.lights_status_char,
-                                        enums.Status.scheduleOff)
-        await aio.sleep_ms(100)
+        np.breath_list[np.nameIndex.Light] = light_transition()
+        if current_mode == enums.Modes.ManualOff[0]:
+            if last_mode != current_mode:
+                log.debug("Lights Manual Off")
+                last_mode = current_mode
+                commands.put((commands.OFF, None, enums.Status.manualOff[0]))
+        elif current_mode == enums.Modes.ManualOn[0]:
+            if last_mode != current_mode or last_colour != ble_colour:
+                log.debug("Lights Manual On")
+                last_mode = current_mode
+                if last_colour != ble_colour:
+                    log.info("Lights Colour Updated: %d", ble_colour)
+                    last_colour = ble_colour
+                # NOTE: set_colour is has a check to turn on lights if they are off
+                put_colour(ble_colour, enums.Status.manualOn[0])
+        elif current_mode == enums.Modes.Auto[0]:
+            sch1 = state.get(Slot.slot_lights_schedule1)
+            sch2 = state.get(Slot.slot_lights_schedule2)
+            if (sch1 != last_sch1 or sch2 != last_sch2 or
+                    schedules.edge_count != last_edge):
+                last_edge = schedules.edge_count
+                last_sch1 = sch1
+                last_sch2 = sch2
+                last_mode = enums.Modes.ManualOff[0]  # force update
+                log.info("Lights Schedule Updated")
+            if last_mode != current_mode:
+                last_mode = current_mode
+                log.debug("Lights Auto")
+                if not (sch1[enums.ScheduleIndex.enabled] and
+                        sch2[enums.ScheduleIndex.enabled]):
+                    log.warning(
+                        "Auto light mode but both schedules are disabled")
+                if schedule_is_running(sch1) and schedule_is_running(sch2):
+                    log.warning("Schedules are overlapping")
+                if schedule_is_running(sch1):
+                    log.info("Lights Auto 1 ON")
+                    put_colour(sch1[enums.ScheduleIndex.config],
+                               enums.Status.schedule1On[0])
+                elif schedule_is_running(sch2):
+                    log.info("Lights Auto 2 ON")
+                    put_colour(sch2[enums.ScheduleIndex.config],
+                               enums.Status.schedule2On[0])
+                else:
+                    log.info("Lights Auto Off")
+                    commands.put((commands.OFF, None,
+                                  enums.Status.scheduleOff[0]))
+        await state.wait(version)  # a state change or a schedule edge
 
 
 async def demo_garden_lights(relays: RelayManager):
-    last_mode = enums.Modes.ManualOff
+    last_mode = enums.Modes.ManualOff[0]
     last_sch1 = (0, 0, 0, 0, 0)
+    last_edge = 0
     last_sch2 = (0, 0, 0, 0, 0)
     while True:
-        ble_mode = ble.gl_mode_char.read()
-        if ble_mode == enums.Modes.ManualOff:
+        version = state.version
+        ble_mode = state.get(Slot.slot_gl_mode)
+        if ble_mode == enums.Modes.ManualOff[0]:
             if last_mode != ble_mode:
                 last_mode = ble_mode
                 log.info("Garden Lights Manual Off")
-                ble.update_char(ble.gl_status_char, enums.Status.transition)
+                state.set(Slot.slot_gl_status, enums.Status.transition[0])
                 relays.GPO1.off()
-                ble.update_char(ble.gl_status_char, enums.Status.manualOff)
-        elif ble_mode == enums.Modes.Auto:
-            sch1 = schedule_from_string(
-                ble.gl_schedule1_char.read().decode())
-            sch2 = schedule_from_string(
-                ble.gl_schedule2_char.read().decode())
-            if sch1 != last_sch1 or sch2 != last_sch2:
+                state.set(Slot.slot_gl_status, enums.Status.manualOff[0])
+        elif ble_mode == enums.Modes.Auto[0]:
+            sch1 = state.get(Slot.slot_gl_schedule1)
+            sch2 = state.get(Slot.slot_gl_schedule2)
+            if (sch1 != last_sch1 or sch2 != last_sch2 or
+                    schedules.edge_count != last_edge):
+                last_edge = schedules.edge_count
                 last_sch1 = sch1
                 last_sch2 = sch2
-                last_mode = enums.Modes.ManualOff  # force update
+                last_mode = enums.Modes.ManualOff[0]  # force update
                 log.info("Garden Lights Schedule Updated")
             if last_mode != ble_mode:
                 last_mode = ble_mode
@@ -391,43 +387,37 @@ async def demo_garden_lights(relays: RelayManager):
                     log.warning("Schedules are overlapping")
                 if schedule_is_running(sch1):
                     log.info("Garden Lights Auto 1 ON")
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.transition)
+                    state.set(Slot.slot_gl_status, enums.Status.transition[0])
                     relays.GPO1.on()
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.schedule1On)
+                    state.set(Slot.slot_gl_status, enums.Status.schedule1On[0])
                 elif schedule_is_running(sch2):
                     log.info("Garden Lights Auto 2 ON")
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.transition)
+                    state.set(Slot.slot_gl_status, enums.Status.transition[0])
                     relays.GPO1.on()
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.schedule2On)
+                    state.set(Slot.slot_gl_status, enums.Status.schedule2On[0])
                 else:
                     log.info("Garden Lights Auto Off")
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.transition)
+                    state.set(Slot.slot_gl_status, enums.Status.transition[0])
                     relays.GPO1.off()
-                    ble.update_char(ble.gl_status_char,
-                                    enums.Status.scheduleOff)
+                    state.set(Slot.slot_gl_status, enums.Status.scheduleOff[0])
         else:
             if last_mode != ble_mode:
                 last_mode = ble_mode
-                ble.update_char(ble.gl_status_char, enums.Status.transition)
+                state.set(Slot.slot_gl_status, enums.Status.transition[0])
                 log.info("Garden Lights Manual On")
-                ble.update_char(ble.gl_status_char, enums.Status.manualOn)
+                state.set(Slot.slot_gl_status, enums.Status.manualOn[0])
                 relays.GPO1.on()
-        await aio.sleep_ms(100)
+        await state.wait(version)  # a state change or a schedule edge
 
 
-async def change_valve(transition_func, ble_status_char, final_status, np_index, np_colour):
-    log.debug(f"valve transitioning...")
+async def change_valve(transition_func, status_slot, final_status, np_index, np_colour):
+    log.debug("valve transitioning...")
     np.breath_list[np_index] = True
-    if ble_status_char is not None:
-        ble.update_char(ble_status_char, enums.Status.transition)
+    if status_slot is not None:
+        state.set(status_slot, enums.Status.transition[0])
     await transition_func()
-    if ble_status_char is not None:
-        ble.update_char(ble_status_char, final_status)
+    if status_slot is not None:
+        state.set(status_slot, final_status)
     np.breath_list[np_index] = False
     np.set_colour(np_index, np_colour)
 
@@ -435,25 +425,27 @@ async def change_valve(transition_func, ble_status_char, final_status, np_index,
 async def demo_water_feature():
     last_mode = None
     last_sch1 = (0, 0, 0, 0, 0)
+    last_edge = 0
     last_sch2 = (0, 0, 0, 0, 0)
     while True:
-        ble_mode = ble.wf_mode_char.read()
-        if ble_mode == enums.Modes.ManualOff:
+        version = state.version
+        ble_mode = state.get(Slot.slot_wf_mode)
+        if ble_mode == enums.Modes.ManualOff[0]:
             if last_mode != ble_mode:
                 last_mode = ble_mode
                 log.info("Water Feature Manual Off")
                 await change_valve(valves.set_water_feature_off,
-                                   ble.wf_status_char, enums.Status.manualOff,
+                                   Slot.slot_wf_status, enums.Status.manualOff[0],
                                    np.nameIndex.WaterFeature, Pixels.Colours.BLACK)
-        elif ble_mode == enums.Modes.Auto:
-            sch1 = schedule_from_string(
-                ble.wf_schedule1_char.read().decode())
-            sch2 = schedule_from_string(
-                ble.wf_schedule2_char.read().decode())
-            if sch1 != last_sch1 or sch2 != last_sch2:
+        elif ble_mode == enums.Modes.Auto[0]:
+            sch1 = state.get(Slot.slot_wf_schedule1)
+            sch2 = state.get(Slot.slot_wf_schedule2)
+            if (sch1 != last_sch1 or sch2 != last_sch2 or
+                    schedules.edge_count != last_edge):
+                last_edge = schedules.edge_count
                 last_sch1 = sch1
                 last_sch2 = sch2
-                last_mode = enums.Modes.ManualOff  # force update
+                last_mode = enums.Modes.ManualOff[0]  # force update
                 log.info("Water Feature Schedule Updated")
             if last_mode != ble_mode:
                 last_mode = ble_mode
@@ -466,54 +458,44 @@ async def demo_water_feature():
                 if schedule_is_running(sch1):
                     log.info("Water Feature Auto 1 ON")
                     await change_valve(valves.set_water_feature_on,
-                                       ble.wf_status_char, enums.Status.schedule1On,
+                                       Slot.slot_wf_status, enums.Status.schedule1On[0],
                                        np.nameIndex.WaterFeature, np.Colours.ORANGE)
                 elif schedule_is_running(sch2):
                     log.info("Water Feature Auto 2 ON")
                     await change_valve(valves.set_water_feature_on,
-                                       ble.wf_status_char, enums.Status.schedule2On,
+                                       Slot.slot_wf_status, enums.Status.schedule2On[0],
                                        np.nameIndex.WaterFeature, np.Colours.ORANGE)
                 else:
                     log.info("Water Feature Auto Off")
                     await change_valve(valves.set_water_feature_off,
-                                       ble.wf_status_char, enums.Status.scheduleOff,
+                                       Slot.slot_wf_status, enums.Status.scheduleOff[0],
                                        np.nameIndex.WaterFeature, Pixels.Colours.BLACK)
         else:
             if last_mode != ble_mode:
                 last_mode = ble_mode
                 log.info("Water Feature Manual On")
                 await change_valve(valves.set_water_feature_on,
-                                   ble.wf_status_char, enums.Status.manualOn,
+                                   Slot.slot_wf_status, enums.Status.manualOn[0],
                                    np.nameIndex.WaterFeature, np.Colours.ORANGE)
-        await aio.sleep_ms(100)
-
-
-async def turn_on_pump(heating=True):
-    log.debug("turning on the pump")
-    if heating:
-        np.breath_list[np.nameIndex.Heat] = True
-    relays.GPO2.on()
-    await aio.sleep(10)
-    log.debug("pump on")
-
-
-async def turn_off_pump():
-    log.debug("turning off the pump")
-    relays.GPO2.off()
-    await aio.sleep(3)
-    log.debug("pump off")
-
+        await state.wait(version)  # a state change or a schedule edge
 
-def heater_off(reason=None):
-    if reason != None:
-        log.info(f"Heater Off: {reason}")
-    heater.disable()
 
-
-async def heater_on(reason):
-    log.info(f"Heater On: {reason}")
-    np.clear(np.nameIndex.Heat)
-    await heater.enable()
+async def set_plant(valve_mode, heat, np_index, np_colour, reason=None, pump=True):
+    '''
+    Reconcile the pump, valves and heater, refer to plant_manager
+    np_index breathes while the plant changes and is then set to np_colour
+    '''
+    if plant.needs(pump, valve_mode, heat):
+        np.breath_list[np_index] = True
+        if heat:
+            np.breath_list[np.nameIndex.Heat] = True
+        await plant.reconcile(pump, valve_mode, heat)
+    np.breath_list[np_index] = False
+    np.set_colour(np_index, np_colour)
+    if heat:
+        np.clear(np.nameIndex.Heat)
+    if reason is not None:
+        log.info("Heater %s: %s", "On" if heat else "Off", reason)
 
 
 def neopixel_heater_breath(pool, spa, filter):
@@ -531,96 +513,86 @@ def neopixel_heater_breath(pool, spa, filter):
         np.clear(np.nameIndex.Filtration)
 
 
+async def set_scheduled_heat(sch, index, status):
+    if sch[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Pool[0]:
+        neopixel_heater_breath(True, False, False)
+        await set_plant(Plant.Valves.POOL, True, np.nameIndex.Pool, Pixels.Colours.ORANGE,
+                        "Schedule %d Pool" % index)
+        state.set(Slot.slot_heat_status, status)
+    elif sch[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Spa[0]:
+        neopixel_heater_breath(False, True, False)
+        await set_plant(Plant.Valves.SPA, True, np.nameIndex.Spa, Pixels.Colours.ORANGE,
+                        "Schedule %d Spa" % index)
+        state.set(Slot.slot_heat_status, status)
+    else:
+        log.error("Schedule %d Invalid Heat Mode", index)
+
+
 async def demo_heater(relays: RelayManager):
     last_heat_mode = None  # to force update on first loop
     last_sch1 = (0, 0, 0, 0, 0)
+    last_edge = 0
     last_sch2 = (0, 0, 0, 0, 0)
     # ble_heat_target_temp = 0
     while True:
-        spa_refill_mode = ble.spa_refill_mode_char.read()
-        if spa_refill_mode == enums.Modes.ManualOn:
-            spa_refill_minutes = ble.spa_refill_manual_config_char.read()[0]
+        version = state.version
+        spa_refill_mode = state.get(Slot.slot_spa_refill_mode)
+        if spa_refill_mode == enums.Modes.ManualOn[0]:
+            spa_refill_minutes = state.get(Slot.slot_spa_refill_minutes)
+            spa_refill.reset()
             log.debug("Setting valves to spa refill position...")
             neopixel_heater_breath(True, True, True)
-            ble.update_char(ble.spa_refill_status_char,
-                            enums.Status.transition)
-            heater_off("Spa Refill")
-            await turn_off_pump()
-            await valves.set_spa_refill()
-            ble.update_char(ble.spa_refill_status_char, enums.Status.manualOn)
-            log.info(f"Spa Refill On: {spa_refill_minutes} minutes")
-            await turn_on_pump(heating=False)
-            for _ in range(spa_refill_minutes * 60 * 100):
-                await aio.sleep_ms(10)
-                if ble.spa_refill_mode_char.read() == enums.Modes.ManualOff:
-                    log.info("Spa Refill cancelled")
-                    break
+            state.set(Slot.slot_spa_refill_status, enums.Status.transition[0])
+            await set_plant(Plant.Valves.SPA_REFILL, False, np.nameIndex.Spa,
+                            Pixels.Colours.ORANGE, "Spa Refill")
+            state.set(Slot.slot_spa_refill_status, enums.Status.manualOn[0])
+            log.info("Spa Refill On: %d minutes", spa_refill_minutes)
+            if not await spa_refill.run(spa_refill_minutes * 60):
+                log.info("Spa Refill cancelled")
             log.info("Spa Refill Off")
-            ble.update_char(ble.spa_refill_status_char,
-                            enums.Status.transition)
-            await turn_off_pump()
-            ble.update_char(ble.spa_refill_status_char,
-                            enums.Status.manualOff)
-            ble.update_char(ble.spa_refill_mode_char, enums.Modes.ManualOff)
+            state.set(Slot.slot_spa_refill_status, enums.Status.transition[0])
+            await plant.reconcile(False)
+            state.set(Slot.slot_spa_refill_status, enums.Status.manualOff[0])
+            state.set(Slot.slot_spa_refill_mode, enums.Modes.ManualOff[0])
             # NOTE: let the heat mode take over the valves
             last_heat_mode = None
 
-        ble_mode = ble.heat_mode_char.read()
-        if ble_mode == enums.HeaterModes.Off_Filter:
+        ble_mode = state.get(Slot.slot_heat_mode)
+        if ble_mode == enums.HeaterModes.Off_Filter[0]:
             if last_heat_mode != ble_mode:
                 last_heat_mode = ble_mode
-                heater_off("Manual Off/Filtration")
                 neopixel_heater_breath(False, False, True)
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.transition_)
-                await turn_off_pump()
-                await change_valve(valves.set_pool_mode,
-                                   None, None,
-                                   np.nameIndex.Filtration, Pixels.Colours.ORANGE)
-                await turn_on_pump(heating=False)
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualOff_Filter)
-        elif ble_mode == enums.HeaterModes.Pool:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                await set_plant(Plant.Valves.POOL, False, np.nameIndex.Filtration,
+                                Pixels.Colours.ORANGE, "Manual Off/Filtration")
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualOff_Filter[0])
+        elif ble_mode == enums.HeaterModes.Pool[0]:
             if last_heat_mode != ble_mode:
                 last_heat_mode = ble_mode
                 neopixel_heater_breath(True, False, False)
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.transition_)
-                heater_off()
-                await turn_off_pump()
-                await change_valve(valves.set_pool_mode,
-                                   None, None,
-                                   np.nameIndex.Pool, Pixels.Colours.ORANGE)
-                await turn_on_pump()
-                await heater_on("Manual Pool")
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualPool)
-                # ble_heat_target_temp = ble.heat_manual_config_char.read()[0]
-        elif ble_mode == enums.HeaterModes.Spa:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                await set_plant(Plant.Valves.POOL, True, np.nameIndex.Pool,
+                                Pixels.Colours.ORANGE, "Manual Pool")
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualPool[0])
+                # ble_heat_target_temp = state.get(Slot.slot_heat_pool_setpoint)
+        elif ble_mode == enums.HeaterModes.Spa[0]:
             if last_heat_mode != ble_mode:
                 last_heat_mode = ble_mode
                 neopixel_heater_breath(False, True, False)
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.transition_)
-                heater_off()
-                await turn_off_pump()
-                await change_valve(valves.set_spa_mode,
-                                   None, None,
-                                   np.nameIndex.Spa, Pixels.Colours.ORANGE)
-                await turn_on_pump()
-                await heater_on("Manual Spa")
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualSpa)
-                # ble_heat_target_temp = ble.heat_manual_config_char.read()[1]
-        elif ble_mode == enums.HeaterModes.Automatic:
-            sch1 = schedule_from_string(
-                ble.heat_schedule1_char.read().decode())
-            sch2 = schedule_from_string(
-                ble.heat_schedule2_char.read().decode())
-            if sch1 != last_sch1 or sch2 != last_sch2:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                await set_plant(Plant.Valves.SPA, True, np.nameIndex.Spa,
+                                Pixels.Colours.ORANGE, "Manual Spa")
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualSpa[0])
+                # ble_heat_target_temp = state.get(Slot.slot_heat_spa_setpoint)
+        elif ble_mode == enums.HeaterModes.Automatic[0]:
+            sch1 = state.get(Slot.slot_heat_schedule1)
+            sch2 = state.get(Slot.slot_heat_schedule2)
+            if (sch1 != last_sch1 or sch2 != last_sch2 or
+                    schedules.edge_count != last_edge):
+                last_edge = schedules.edge_count
                 last_sch1 = sch1
                 last_sch2 = sch2
-                last_heat_mode = enums.HeaterModes.Off_Filter  # force update
+                last_heat_mode = enums.HeaterModes.Off_Filter[0]  # force update
                 log.info("Heater Schedule Updated")
             if last_heat_mode != ble_mode:
                 last_heat_mode = ble_mode
@@ -629,196 +601,141 @@ async def demo_heater(relays: RelayManager):
                         sch2[enums.ScheduleIndex.enabled]):
                     log.warning(
                         "Auto heater mode but both schedules are disabled")
-                    if schedule_is_running(sch1) and schedule_is_running(sch2):
-                        log.warning("Schedules are overlapping")
-                    if schedule_is_running(sch1):
-                        log.info("Heater Auto 1 ON")
-                        neopixel_heater_breath(True, True, False)
-                        ble.update_char(ble.heat_status_char,
-                                        enums.HeaterStatus.transition_)
-                        heater_off()
-                        await turn_off_pump()
-                        if sch1[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Pool[0]:
-                            neopixel_heater_breath(True, False, False)
-                            await change_valve(valves.set_pool_mode,
-                                               None, None,
-                                               np.nameIndex.Pool, Pixels.Colours.ORANGE)
-                            await turn_on_pump()
-                            await heater_on("Schedule 1 Pool")
-                            ble.update_char(ble.heat_status_char,
-                                            enums.HeaterStatus.schedule1On_)
-                        elif sch1[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Spa[0]:
-                            neopixel_heater_breath(False, True, False)
-                            await change_valve(valves.set_spa_mode,
-                                               None, None,
-                                               np.nameIndex.Spa, Pixels.Colours.ORANGE)
-                            await turn_on_pump()
-                            await heater_on("Schedule 1 Spa")
-                            ble.update_char(ble.heat_status_char,
-                                            enums.HeaterStatus.schedule1On_)
-                        else:
-                            log.error("Schedule 1 Invalid Heat Mode")
-                        # ble_heat_target_temp = sch1[enums.ScheduleIndex.config]
-                    elif schedule_is_running(sch2):
-                        log.info("Heater Auto 2 ON")
-                        neopixel_heater_breath(True, True, False)
-                        ble.update_char(ble.heat_status_char,
-                                        enums.HeaterStatus.transition_)
-                        heater_off()
-                        await turn_off_pump()
-                        if sch2[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Pool[0]:
-                            neopixel_heater_breath(True, False, False)
-                            await change_valve(valves.set_pool_mode,
-                                               None, None,
-                                               np.nameIndex.Pool, Pixels.Colours.ORANGE)
-                            await turn_on_pump()
-                            await heater_on("Schedule 2 Pool")
-                            ble.update_char(ble.heat_status_char,
-                                            enums.HeaterStatus.schedule2On_)
-                        elif sch2[enums.ScheduleIndex.heat_mode] == enums.HeaterModes.Spa[0]:
-                            neopixel_heater_breath(False, True, False)
-                            await change_valve(valves.set_spa_mode,
-                                               None, None,
-                                               np.nameIndex.Spa, Pixels.Colours.ORANGE)
-                            await turn_on_pump()
-                            await heater_on("Schedule 2 Spa")
-                            ble.update_char(ble.heat_status_char,
-                                            enums.HeaterStatus.schedule2On_)
-                        else:
-                            log.error("Schedule 2 Invalid Heat Mode")
-                        # ble_heat_target_temp = sch2[enums.ScheduleIndex.config]
-                    else:
-                        heater_off("Auto Off/Filtration")
-                        neopixel_heater_breath(False, False, True)
-                        ble.update_char(ble.heat_status_char,
-                                        enums.HeaterStatus.transition_)
-                        await turn_off_pump()
-                        await change_valve(valves.set_pool_mode,
-                                           None, None,
-                                           np.nameIndex.Filtration, Pixels.Colours.BLACK)
-                        await turn_on_pump(heating=False)
-                        ble.update_char(ble.heat_status_char,
-                                        enums.HeaterStatus.scheduleOff_)
+                if schedule_is_running(sch1) and schedule_is_running(sch2):
+                    log.warning("Schedules are overlapping")
+                if schedule_is_running(sch1):
+                    log.info("Heater Auto 1 ON")
+                    neopixel_heater_breath(True, True, False)
+                    state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                    await set_scheduled_heat(sch1, 1, enums.HeaterStatus.schedule1On_[0])
+                    # ble_heat_target_temp = sch1[enums.ScheduleIndex.config]
+                elif schedule_is_running(sch2):
+                    log.info("Heater Auto 2 ON")
+                    neopixel_heater_breath(True, True, False)
+                    state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                    await set_scheduled_heat(sch2, 2, enums.HeaterStatus.schedule2On_[0])
+                    # ble_heat_target_temp = sch2[enums.ScheduleIndex.config]
+                else:
+                    neopixel_heater_breath(False, False, True)
+                    state.set(Slot.slot_heat_status, enums.HeaterStatus.transition_[0])
+                    await set_plant(Plant.Valves.POOL, False, np.nameIndex.Filtration,
+                                    Pixels.Colours.BLACK, "Auto Off/Filtration")
+                    state.set(Slot.slot_heat_status, enums.HeaterStatus.scheduleOff_[0])
 
         # TODO: Is this the correct location?
-        ble_heat_status = ble.heat_status_char.read()
-        if ble_heat_status == enums.HeaterStatus.transition_:
-            ble_heat_mode = ble.heat_mode_char.read()
-            if ble_heat_mode == enums.HeaterModes.Off_Filter:
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualOff_Filter)
-            elif ble_heat_mode == enums.HeaterModes.Pool:
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualPool)
-            elif ble_heat_mode == enums.HeaterModes.Spa:
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.manualSpa)
-            elif ble_heat_mode == enums.HeaterModes.Automatic:
-                ble.update_char(ble.heat_status_char,
-                                enums.HeaterStatus.scheduleOff_)
+        ble_heat_status = state.get(Slot.slot_heat_status)
+        if ble_heat_status == enums.HeaterStatus.transition_[0]:
+            ble_heat_mode = state.get(Slot.slot_heat_mode)
+            if ble_heat_mode == enums.HeaterModes.Off_Filter[0]:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualOff_Filter[0])
+            elif ble_heat_mode == enums.HeaterModes.Pool[0]:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualPool[0])
+            elif ble_heat_mode == enums.HeaterModes.Spa[0]:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.manualSpa[0])
+            elif ble_heat_mode == enums.HeaterModes.Automatic[0]:
+                state.set(Slot.slot_heat_status, enums.HeaterStatus.scheduleOff_[0])
             else:
                 log.error("Invalid Heat Mode")
 
-        if ble_heat_status in (enums.HeaterStatus.manualPool,
-                               enums.HeaterStatus.manualSpa,
-                               enums.HeaterStatus.schedule1On_,
-                               enums.HeaterStatus.schedule2On_):
+        if ble_heat_status in (enums.HeaterStatus.manualPool[0],
+                               enums.HeaterStatus.manualSpa[0],
+                               enums.HeaterStatus.schedule1On_[0],
+                               enums.HeaterStatus.schedule2On_[0]):
             ble_heat_target_temp = 0
-            if ble_heat_status == enums.HeaterStatus.manualPool:
-                ble_heat_target_temp = ble.heat_manual_config_char.read()[0]
-            elif ble_heat_status == enums.HeaterStatus.manualSpa:
-                ble_heat_target_temp = ble.heat_manual_config_char.read()[1]
-            elif ble_heat_status == enums.HeaterStatus.schedule1On_:
-                sch1 = schedule_from_string(
-                    ble.heat_schedule1_char.read().decode())
+            if ble_heat_status == enums.HeaterStatus.manualPool[0]:
+                ble_heat_target_temp = state.get(Slot.slot_heat_pool_setpoint)
+            elif ble_heat_status == enums.HeaterStatus.manualSpa[0]:
+                ble_heat_target_temp = state.get(Slot.slot_heat_spa_setpoint)
+            elif ble_heat_status == enums.HeaterStatus.schedule1On_[0]:
+                sch1 = state.get(Slot.slot_heat_schedule1)
                 ble_heat_target_temp = sch1[enums.ScheduleIndex.config]
-            elif ble_heat_status == enums.HeaterStatus.schedule2On_:
-                sch2 = schedule_from_string(
-                    ble.heat_schedule2_char.read().decode())
+            elif ble_heat_status == enums.HeaterStatus.schedule2On_[0]:
+                sch2 = state.get(Slot.slot_heat_schedule2)
                 ble_heat_target_temp = sch2[enums.ScheduleIndex.config]
             ble_heat_target_temp *= 100  # convert to centiCelsius
             if heater.get_target_temperature() != (ble_heat_target_temp):
-                log.info(f"Heater Target Updated: {ble_heat_target_temp}")
+                log.info("Heater Target Updated: %d", ble_heat_target_temp)
                 await heater.set_target_temperature(ble_heat_target_temp)
 
-        await aio.sleep_ms(100)
+        await state.wait(version)  # a state change or a schedule edge
+
+
+def _heater_bar_levels(temp):
+    level = (temp - 15) / 25 * 4
+    return tuple(min(1, max(0, level - i)) for i in range(4))
+
+
+# Heat1..Heat4 brightness per target temperature, 15C to 40C
+HEATER_BAR = tuple(_heater_bar_levels(temp) for temp in range(15, 41))
+
+
+def heater_bar_target(config, status):
+    '''
+    Target temperature shown on the heater bar, 15 (empty bar) during a transition
+    '''
+    if status == enums.HeaterStatus.manualPool[0]:  # pool
+        return config[0]
+    if status == enums.HeaterStatus.manualSpa[0]:  # spa
+        return config[1]
+    if status == enums.HeaterStatus.schedule1On_[0]:
+        return state.get(Slot.slot_heat_schedule1)[enums.ScheduleIndex.config]
+    if status == enums.HeaterStatus.schedule2On_[0]:
+        return state.get(Slot.slot_heat_schedule2)[enums.ScheduleIndex.config]
+    return 15
 
 
 async def demo_heater_neopixel():
+    '''
+    Only woken when the heat status, setpoints or schedules, the pending setpoint or the heater change
+    '''
+    heat_pixels = (np.nameIndex.Heat1, np.nameIndex.Heat2,
+                   np.nameIndex.Heat3, np.nameIndex.Heat4)
+    wake = aio.ThreadSafeFlag()
+
+    def changed(*args):
+        wake.set()
+
+    # the heater bar target only depends on these slots
+    state.subscribe(changed, (Slot.slot_heat_status, Slot.slot_heat_pool_setpoint,
+                              Slot.slot_heat_spa_setpoint, Slot.slot_heat_schedule1,
+                              Slot.slot_heat_schedule2))
+    ui.setpoint.changed = changed
+    heater.changed = changed
+    last_bar = None
+    last_heat = None
     while True:
-        ble_heat_config = ble.heat_manual_config_char.read()
-        ble_heat_status = ble.heat_status_char.read()
-        # heat LEDs
-        # if ble_heat_status in (enums.HeaterStatus.manualPool,
-        #                        enums.HeaterStatus.manualSpa,
-        #                        enums.HeaterStatus.schedule1On_,
-        #                        enums.HeaterStatus.schedule2On_):
         if heater.is_enabled():
-            if ble_heat_status == enums.HeaterStatus.manualPool:  # pool
-                temp = ble_heat_config[0]
-            elif ble_heat_status == enums.HeaterStatus.manualSpa:  # spa
-                temp = ble_heat_config[1]
-            elif ble_heat_status == enums.HeaterStatus.schedule1On_:
-                sch1 = schedule_from_string(
-                    ble.heat_schedule1_char.read().decode())
-                temp = sch1[enums.ScheduleIndex.config]
-            elif ble_heat_status == enums.HeaterStatus.schedule2On_:
-                sch2 = schedule_from_string(
-                    ble.heat_schedule2_char.read().decode())
-                temp = sch2[enums.ScheduleIndex.config]
-            else:
-                temp = 15  # default to zero for transition
-
-            if temp > 40:  # max temp
-                temp = 40
-            elif temp < 15:  # min temp
-                temp = 15
-            temp0 = ((temp - 15) / 25 * 4)
-
-            if temp0 > 4:
-                temp0 = 4
-            elif temp0 < 0:
-                temp0 = 0
-
-            if temp0 <= 1:
-                brightness1 = temp0-0
-                brightness2 = 0
-                brightness3 = 0
-                brightness4 = 0
-            elif temp0 <= 2:
-                brightness1 = 1
-                brightness2 = temp0-1
-                brightness3 = 0
-                brightness4 = 0
-            elif temp0 <= 3:
-                brightness1 = 1
-                brightness2 = 1
-                brightness3 = temp0-2
-                brightness4 = 0
-            else:
-                brightness1 = 1
-                brightness2 = 1
-                brightness3 = 1
-                brightness4 = temp0-3
-
-            np.set_colour(np.nameIndex.Heat1, np.Colours.ORANGE, brightness1)
-            np.set_colour(np.nameIndex.Heat2, np.Colours.ORANGE, brightness2)
-            np.set_colour(np.nameIndex.Heat3, np.Colours.ORANGE, brightness3)
-            np.set_colour(np.nameIndex.Heat4, np.Colours.ORANGE, brightness4)
+            # show a setpoint being adjusted on the buttons before it is committed
+            config = ui.setpoint.pending() or (state.get(Slot.slot_heat_pool_setpoint),
+                                               state.get(Slot.slot_heat_spa_setpoint))
+            temp = heater_bar_target(config, state.get(Slot.slot_heat_status))
+            bar = HEATER_BAR[min(40, max(15, temp)) - 15]
         else:
-            # all off
-            np.clear(np.nameIndex.Heat1)
-            np.clear(np.nameIndex.Heat2)
-            np.clear(np.nameIndex.Heat3)
-            np.clear(np.nameIndex.Heat4)
+            bar = None
+        if bar != last_bar:
+            last_bar = bar
+            for i in range(4):
+                if bar is None:
+                    np.clear(heat_pixels[i])
+                else:
+                    np.set_colour(heat_pixels[i], np.Colours.ORANGE, bar[i])
 
+        # NOTE: set_plant ends the heat breath before the heat status is set, which wakes this
         if heater.is_running():
-            np.clear(np.nameIndex.Heat)
-            np.set_colour(np.nameIndex.Heat, np.Colours.RED, 0.5)
+            heat = 1
         elif not np.breath_list[np.nameIndex.Heat]:
-            np.clear(np.nameIndex.Heat)
+            heat = 0
+        else:
+            heat = None  # left to the breath task
+        if heat != last_heat:
+            last_heat = heat
+            if heat == 1:
+                np.clear(np.nameIndex.Heat)
+                np.set_colour(np.nameIndex.Heat, np.Colours.RED, 0.5)
+            elif heat == 0:
+                np.clear(np.nameIndex.Heat)
 
-        await aio.sleep_ms(50)
+        await wake.wait()
 
 
 async def demo_neopixel_breath(np: Pixels):
@@ -842,37 +759,58 @@ async def demo_neopixel_breath(np: Pixels):
         await aio.sleep_ms(50)
 
 
-async def demo_water_temp():
+async def demo_water_temp(deadband_centiC=20, max_interval_s=60, sample_s=5):
+    '''
+    Publish the water temperature when it moves more than deadband_centiC
+    or when max_interval_s has elapsed since the last publish.
+    '''
     last_temp = None
+    last_publish = time.ticks_ms()
     while True:
-        if ble.is_connected():
-            temp = await heater.get_rounded_temperature()
-            if temp != last_temp:
-                last_temp = temp
-                msg = "{:.1f}".format(temp/100)
-                log.debug(f"Water Temp Changed: {msg}")
-                ble.update_char(ble.water_temperature_char, msg)
-                await aio.sleep(5)
-        else:
-            await aio.sleep(1)
-            last_temp = None
+        temp = await heater.get_shared_temperature(sample_s * 1000)
+        if (last_temp is None or abs(temp - last_temp) >= deadband_centiC or
+                time.ticks_diff(time.ticks_ms(), last_publish) >= max_interval_s * 1000):
+            last_temp = temp
+            last_publish = time.ticks_ms()
+            log.debug("Water Temp Changed: %d", temp)
+            ble.set_water_temperature(temp)
+        await aio.sleep(sample_s)
 
 
 async def demo_time():
-    def convert_int_to_hex(i):
-        a = i // 10
-        b = i % 10
-        return a*16 + b
-    while True:
-        await aio.sleep(1)
-        # wd and yd not used.
-        yyyy, mm, dd, HH, MM, SS, wd, yd = time.localtime()
+    '''
+    Serve the time characteristic on demand:
+    written once on connection, then every second only while the client is subscribed.
+    When the stack does not report the subscription (ESP32/NimBLE, refer to BLEManager._read_cccds)
+    it is refreshed once a minute instead.
+    '''
+    def to_bcd(i):
+        return ((i // 10) << 4) | (i % 10)
 
-        t = bytes([convert_int_to_hex(yyyy//100), convert_int_to_hex(yyyy % 100),
-                   convert_int_to_hex(mm), convert_int_to_hex(dd),
-                   convert_int_to_hex(HH), convert_int_to_hex(MM), convert_int_to_hex(SS)])
-        # log.debug(f"Time: {t}")
-        ble.update_char(ble.time_sync_char, t)
+    t = bytearray(7)
+    while True:
+        await ble.wait_connected()
+        refresh = True  # always refresh once on connection for reads
+        last_minute = None
+        while ble.is_connected():
+            clock.update()
+            subscribed = ble.is_subscribed(ble.time_sync_char)
+            if refresh or subscribed or (subscribed is None and clock.minute != last_minute):
+                last_minute = clock.minute
+                t[0] = to_bcd(clock.year // 100)
+                t[1] = to_bcd(clock.year % 100)
+                t[2] = to_bcd(clock.month)
+                t[3] = to_bcd(clock.day)
+                t[4] = to_bcd(clock.hour)
+                t[5] = to_bcd(clock.minute)
+                t[6] = to_bcd(clock.second)
+                ble.update_char(ble.time_sync_char, t)
+            refresh = False
+            if subscribed is None:
+                # wake on the next minute, a disconnect is picked up then
+                await aio.sleep(max(1, 60 - clock.second))
+            else:
+                await aio.sleep(1)
 
 
 def adc_to_celsius(adc_val):
@@ -893,53 +831,13 @@ def adc_to_celsius(adc_val):
     return temperature_c
 
 
-def schedule_from_string(string):
-    '''
-    expected schedule string format:
-    start, end, dow, enabled, [config], [mode]
-    '''
-    temp = string.split(',')
-    schedule = tuple(int(i) for i in temp)
-    if len(schedule) not in (4, 5, 6):
-        log.error("Invalid Schedule String, using default values!!!")
-    return schedule
-
-
 def schedule_is_running(sch):
     '''
-        Check if the schedule is running
+        Check if the schedule is running, refer to library.clock
     '''
-    def datetime_to_seconds(dt):
-        '''
-        dt: tuple of 8 integers representing
-        (compatible with mpy time.localtime())
-        year, month, day, hour, minute, second, week of year, day of year
-        '''
-        return dt[3] * 3600 + dt[4] * 60 + dt[5]
-
-    def is_today_enabled(dow):
-        '''
-        dow: is binary bit field of the day of the week
-        0: Monday
-        1: Tuesday
-        2: Wednesday
-        3: Thursday
-        4: Friday
-        5: Saturday
-        6: Sunday
-        '''
-        today = time.localtime()[6]
-        return dow & (1 << today)
-
-    is_running: bool = False
-    today = time.localtime()[6]
-    if sch[enums.ScheduleIndex.enabled] and is_today_enabled(sch[enums.ScheduleIndex.dow]):
-        current_time = datetime_to_seconds(time.localtime())
-        if sch[enums.ScheduleIndex.start] <= current_time <= sch[enums.ScheduleIndex.end]:
-            is_running = True
-    else:
-        is_running = False
-    return is_running
+    return bool(sch[enums.ScheduleIndex.enabled] and
+                sch[enums.ScheduleIndex.dow] & (1 << clock.weekday) and
+                sch[enums.ScheduleIndex.start] <= clock.seconds <= sch[enums.ScheduleIndex.end])
 
 
 def fake_heater_on():
@@ -965,11 +863,28 @@ heater = Heater(fake_heater_on, fake_heater_off, relays.Heater.value,
                 lambda: adc_to_celsius(WaterTemp.read())*100,
                 off_check_period_s=20, minimum_on_time_s=10)
 ui = ui_manager.UIManager(ble, heater, i2c)
-ble.update_char(ble.heat_mode_char, bytes([2]))
+plant = PlantManager(valves, relays.GPO2, heater.enable, heater.disable,
+                     heater.is_enabled)
+spa_refill = Countdown()
+ble.spa_refill_cancel = spa_refill.cancel
+
+pcf = get_pcf(i2c)
+rtc_flag = aio.ThreadSafeFlag()
+try:
+    pcf.attach_interrupt(Pin(board.RTC_nINT, Pin.IN, Pin.PULL_UP), rtc_flag)
+except AttributeError:
+    log.error("RTC_nINT pin not defined, schedules fall back to a timer")
+schedules = schedule.ScheduleService(
+    lambda: [state.get(slot) for slot in range(Slot.slot_lights_schedule1,
+                                               Slot.slot_gl_schedule2 + 1)],
+    pcf.set_alarm, pcf.clear_alarm, rtc_flag,
+    on_edge=lambda count: state.set(Slot.slot_schedule_edge, count))
+ble.schedule_changed = schedules.rearm
 
 
 loop = aio.new_event_loop()
 
+loop.create_task(clock.tasks())
 loop.create_task(np.tasks())
 loop.create_task(demo_neopixel_breath(np))
 loop.create_task(ble.tasks())
@@ -985,5 +900,7 @@ loop.create_task(demo_garden_lights(relays))
 loop.create_task(demo_water_feature())
 loop.create_task(demo_heater(relays))
 loop.create_task(demo_water_temp())
+loop.create_task(logring.ring.tasks())
+loop.create_task(schedules.tasks())
 
 loop.run_forever()
@@ -0,0 +1,100 @@
+'''
+Reconciles the pump, valves and heater (the plant) with a desired state.
+
+The actual state is kept from the last reconcile (valves) and read back from
+the hardware (pump relay, heater enable), and only what differs is changed:
+Pool -> Off/Filter only disables the heater, the valves and pump are left alone.
+
+Ordering rules:
+the heater is disabled before the pump stops or the valves move (no flow),
+the pump is stopped while the valves move,
+the heater is only enabled after the pump has primed.
+'''
+from relay_manager import Relay  # only for type hinting
+from valves_manager import ValveManager  # only for type hinting
+import uasyncio as aio
+from library.logger import Log
+
+log = Log(__name__, Log.DEBUG).get_logger()
+
+
+class Plant:
+    class Valves:
+        POOL = const(0)  # also filtration
+        SPA = const(1)
+        SPA_REFILL = const(2)
+
+
+class PlantManager:
+
+    def __init__(self, valves: ValveManager, pump: Relay, heater_enable, heater_disable, heater_is_enabled,
+                 pump_prime_s=10, pump_stop_s=3):
+        '''
+        heater_enable: coroutine function enabling the heater
+        heater_disable, heater_is_enabled: functions disabling/reading the heater enable
+        pump_prime_s: time for the flow to establish before the heater can be enabled
+        pump_stop_s: time for the flow to stop before the valves move
+        '''
+        self._move = {
+            Plant.Valves.POOL: valves.set_pool_mode,
+            Plant.Valves.SPA: valves.set_spa_mode,
+            Plant.Valves.SPA_REFILL: valves.set_spa_refill,
+        }
+        self._pump = pump
+        self._heater_enable = heater_enable
+        self._heater_disable = heater_disable
+        self._heater_is_enabled = heater_is_enabled
+        self._pump_prime_s = pump_prime_s
+        self._pump_stop_s = pump_stop_s
+        self.valves = None  # unknown until the first move
+        self.actions = 0
+
+    def pump_on(self):
+        return bool(self._pump.value())
+
+    def needs(self, pump, valves=None, heater=False):
+        '''
+        True if reconcile would change anything
+        '''
+        return ((valves is not None and valves != self.valves) or
+                bool(pump) != self.pump_on() or
+                bool(heater) != bool(self._heater_is_enabled()))
+
+    async def reconcile(self, pump, valves=None, heater=False):
+        '''
+        Apply the desired state with the minimal set of actions
+        pump: pump on
+        valves: Plant.Valves position, None to leave the valves as they are
+        heater: heater enabled, needs the pump on
+        Returns the number of actions taken
+        '''
+        heater = heater and pump
+        move = valves is not None and valves != self.valves
+        actions = 0
+        if self._heater_is_enabled() and (not heater or move):
+            log.debug("Plant: heater off")
+            self._heater_disable()
+            actions += 1
+        if self.pump_on() and (not pump or move):
+            log.debug("Plant: pump off")
+            self._pump.off()
+            await aio.sleep(self._pump_stop_s)
+            actions += 1
+        if move:
+            log.debug("Plant: valves %s -> %d", self.valves, valves)
+            # the position is unknown while the valves move
+            self.valves = None
+            await self._move[valves]()
+            self.valves = valves
+            actions += 1
+        if pump and not self.pump_on():
+            log.debug("Plant: pump on")
+            self._pump.on()
+            await aio.sleep(self._pump_prime_s)
+            actions += 1
+        if heater and not self._heater_is_enabled():
+            log.debug("Plant: heater on")
+            await self._heater_enable()
+            actions += 1
+        self.actions += actions
+        return actions
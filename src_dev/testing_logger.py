@@ -0,0 +1,52 @@
+'''
+Benchmark for library.logger with the level at WARNING
+Prints the bytes allocated and the time per loop iteration for the disabled
+debug call styles used in the hot loops.
+'''
+from library.logger import Log
+from micropython import const
+import time
+import gc
+
+log = Log("bench", Log.WARNING).get_logger()
+
+ITERATIONS = const(1000)
+
+
+def bench_fstring(temperature):
+    for _ in range(ITERATIONS):
+        log.debug(f"Heater Temperature: {temperature/100}C")
+
+
+def bench_lazy(temperature):
+    for _ in range(ITERATIONS):
+        log.debug("Heater Temperature: %dcC", temperature)
+
+
+def bench_debug_block(temperature):
+    for _ in range(ITERATIONS):
+        if __debug__:
+            log.debug("Heater Temperature: %dcC", temperature)
+
+
+def bench_empty(temperature):
+    for _ in range(ITERATIONS):
+        pass
+
+
+def run(name, func):
+    gc.collect()
+    before = gc.mem_alloc()
+    start = time.ticks_us()
+    func(2550)
+    duration = time.ticks_diff(time.ticks_us(), start)
+    allocated = gc.mem_alloc() - before
+    print(f"{name:<12} {allocated / ITERATIONS:8.1f} B/iter {duration / ITERATIONS:8.1f} us/iter")
+
+
+gc.disable()
+run("empty", bench_empty)
+run("f-string", bench_fstring)
+run("lazy args", bench_lazy)
+run("__debug__", bench_debug_block)
+gc.enable()
@@ -9,9 +9,13 @@ from library import aiobutton
 from library import heater
 from drivers import fxl6408
 from machine import I2C, Pin
+from micropython import const
 import uasyncio as aio
+import time
 from library.logger import Log
 import enums
+from enums import Slot
+from library.state import state
 
 log = Log(__name__, Log.DEBUG).get_logger()
 
@@ -35,6 +39,10 @@ class _FXLButtons:
         def pressed(self):
             return not _FXLButtons._Button_port.pin(self._pin)
 
+        @property
+        def bit(self):
+            return self._pin
+
     def __init__(self, i2c):
         _FXLButtons._Button_port = fxl6408.FXL6408(i2c)
         self.water_feature = _FXLButtons._Button(0)
@@ -46,177 +54,215 @@ class _FXLButtons:
         self.power = _FXLButtons._Button(6)
 
 
+class _PendingSetpoint:
+    '''
+    Heat setpoint adjusted by the increment/decrement buttons.
+    Presses (and hold repeats) only change the pending value, it is written to
+    the state store once the buttons are left alone for SETTLE_ms,
+    so BLE and the heater see a single change for a whole adjustment.
+    '''
+    SETTLE_ms = const(1500)
+    MIN_C = const(15)
+    MAX_C = const(40)
+
+    _SLOTS = (Slot.slot_heat_pool_setpoint, Slot.slot_heat_spa_setpoint)
+
+    def __init__(self):
+        self.value = bytearray(2)  # pool, spa
+        self._dirty = 0  # bit per value index
+        self._last = 0
+        self._flag = aio.ThreadSafeFlag()
+        self.version = 0  # incremented on every adjustment
+        # called on every adjustment and commit, i.e. to refresh the LEDs
+        self.changed = None
+
+    def pending(self):
+        '''
+        Return the pending (pool, spa) setpoint for the LEDs, None when there is no change pending
+        '''
+        return self.value if self._dirty else None
+
+    def adjust(self, delta):
+        '''
+        Returns False if the heater is not in pool or spa mode
+        '''
+        current_mode = state.get(Slot.slot_heat_mode)
+        if current_mode == enums.HeaterModes.Pool[0]:
+            index = 0
+        elif current_mode == enums.HeaterModes.Spa[0]:
+            index = 1
+        else:
+            return False
+        if not self._dirty:
+            for i in range(2):
+                self.value[i] = state.get(self._SLOTS[i])
+        self.value[index] = min(self.MAX_C, max(self.MIN_C, self.value[index] + delta))
+        self._dirty |= 1 << index
+        self.version += 1
+        self._last = time.ticks_ms()
+        log.debug("pending setpoint: %d %d", self.value[0], self.value[1])
+        self._flag.set()
+        if self.changed is not None:
+            self.changed()
+        return True
+
+    def _commit(self):
+        # only the adjusted values, a BLE write of the other one is kept
+        dirty = self._dirty
+        self._dirty = 0
+        for i in range(2):
+            if dirty & (1 << i):
+                state.set(self._SLOTS[i], self.value[i])
+        log.debug("setpoint committed: %d %d", self.value[0], self.value[1])
+        if self.changed is not None:
+            self.changed()
+
+    async def tasks(self):
+        while True:
+            await self._flag.wait()
+            while True:
+                wait_ms = self.SETTLE_ms - time.ticks_diff(time.ticks_ms(), self._last)
+                if wait_ms <= 0:
+                    break
+                await aio.sleep_ms(wait_ms)
+            self._commit()
+
+
 class UIManager:
     ble: BLEManager
     heat: heater.Heater
+    setpoint: _PendingSetpoint
 
     def __init__(self, ble: BLEManager, heater: heater.Heater, i2c: I2C | None = None):
         board = Pin.board
         UIManager.ble = ble
         UIManager.heat = heater
+        UIManager.setpoint = _PendingSetpoint()
 
         if i2c is None:
             i2c = I2C(1, scl=board.I2C_SCL, sda=board.I2C_SDA)
         self._buttons = _FXLButtons(i2c)
 
-        self._btn_light = aiobutton.AIOButton(
-            lambda x: self._buttons.light.pressed,
-            h_release=btn_light_released_handler,
-            h_hold=btn_light_hold_handler,
-            hold_ms=1000,
-            hold_repeat=False)
-
-        self._btn_light_colour = aiobutton.AIOButton(
-            lambda x: self._buttons.light_colour.pressed,
-            h_release=btn_light_colour_released_handler,
-            h_hold=btn_light_colour_hold_handler,
-            hold_ms=3000,
-            hold_repeat=False)
-
-        self._btn_water_feature = aiobutton.AIOButton(
-            lambda x: self._buttons.water_feature.pressed,
-            h_release=btn_water_feature_released_handler,
-            h_hold=btn_water_feature_hold_handler,
-            hold_ms=1000,
-            hold_repeat=False)
-
-        self._btn_heat_mode = aiobutton.AIOButton(
-            lambda x: self._buttons.heat_toggle.pressed,
-            h_release=btn_heat_mode_released_handler,
-            h_hold=btn_heat_mode_hold_handler,
-            hold_ms=1000,
-            hold_repeat=False)
-
-        self._btn_heat_increment = aiobutton.AIOButton(
-            lambda x: self._buttons.heat_increment.pressed,
-            h_release=btn_heat_increment_released_handler,
-            h_hold=btn_heat_increment_released_handler,
-            hold_ms=1000,
-            hold_repeat=True)
-
-        self._btn_heat_decrement = aiobutton.AIOButton(
-            lambda x: self._buttons.heat_decrement.pressed,
-            h_release=btn_heat_decrement_released_handler,
-            h_hold=btn_heat_decrement_released_handler,
-            hold_ms=1000,
-            hold_repeat=True)
-
-        self._btn_power = aiobutton.AIOButton(
-            lambda x: self._buttons.power.pressed,
-            h_release=btn_power_released_handler,
-            h_hold=btn_power_hold_handler,
-            hold_ms=1000,
-            hold_repeat=False)
+        # all buttons live on the same FXL6408 port, scan it once per tick
+        self._button_group = aiobutton.ButtonGroup(
+            lambda: _FXLButtons._Button_port.port, active_low=True)
+        group = self._button_group
+        group.add(self._buttons.light.bit,
+                  h_release=btn_light_released_handler,
+                  h_hold=btn_light_hold_handler,
+                  hold_ms=1000,
+                  hold_repeat=False)
+        group.add(self._buttons.light_colour.bit,
+                  h_release=btn_light_colour_released_handler,
+                  h_hold=btn_light_colour_hold_handler,
+                  hold_ms=3000,
+                  hold_repeat=False)
+        group.add(self._buttons.water_feature.bit,
+                  h_release=btn_water_feature_released_handler,
+                  h_hold=btn_water_feature_hold_handler,
+                  hold_ms=1000,
+                  hold_repeat=False)
+        group.add(self._buttons.heat_toggle.bit,
+                  h_release=btn_heat_mode_released_handler,
+                  h_hold=btn_heat_mode_hold_handler,
+                  hold_ms=1000,
+                  hold_repeat=False)
+        group.add(self._buttons.heat_increment.bit,
+                  h_release=btn_heat_increment_released_handler,
+                  h_hold=btn_heat_increment_released_handler,
+                  hold_ms=1000,
+                  hold_repeat=True)
+        group.add(self._buttons.heat_decrement.bit,
+                  h_release=btn_heat_decrement_released_handler,
+                  h_hold=btn_heat_decrement_released_handler,
+                  hold_ms=1000,
+                  hold_repeat=True)
+        group.add(self._buttons.power.bit,
+                  h_release=btn_power_released_handler,
+                  h_hold=btn_power_hold_handler,
+                  hold_ms=1000,
+                  hold_repeat=False)
 
     async def tasks(self):
-        await aio.gather(
-            self._btn_light.coro_check(),
-            self._btn_light_colour.coro_check(),
-            self._btn_water_feature.coro_check(),
-            self._btn_heat_mode.coro_check(),
-            self._btn_heat_increment.coro_check(),
-            self._btn_heat_decrement.coro_check(),
-            self._btn_power.coro_check()
-        )
+        await aio.gather(self._button_group.coro_check(),
+                         UIManager.setpoint.tasks())
 
 
 def btn_light_released_handler(btn):
     log.debug("Light button released")
-    current_mode = UIManager.ble.lights_mode_char.read()
-    if current_mode == enums.Modes.ManualOff:
-        current_mode = enums.Modes.ManualOn
+    current_mode = state.get(Slot.slot_lights_mode)
+    if current_mode == enums.Modes.ManualOff[0]:
+        current_mode = enums.Modes.ManualOn[0]
     else:
-        current_mode = enums.Modes.ManualOff
+        current_mode = enums.Modes.ManualOff[0]
 
-    UIManager.ble.update_char(UIManager.ble.lights_mode_char, current_mode)
+    state.set(Slot.slot_lights_mode, current_mode)
 
 
 def btn_light_hold_handler(btn):
     log.debug("Light button hold")
-    current_mode = UIManager.ble.lights_mode_char.read()
-    UIManager.ble.update_char(UIManager.ble.lights_mode_char, enums.Modes.Auto)
+    current_mode = state.get(Slot.slot_lights_mode)
+    state.set(Slot.slot_lights_mode, enums.Modes.Auto[0])
 
 
 def btn_light_colour_released_handler(btn):
     log.debug("Light colour button released")
-    current_colour = UIManager.ble.lights_manual_config_char.read()[0]
+    current_colour = state.get(Slot.slot_lights_colour)
     new_colour = (current_colour + 1) % 10
     if new_colour == enums.Light.ColourCode.Black:
         new_colour = enums.Light.ColourCode.Blue
 
-    UIManager.ble.update_char(
-        UIManager.ble.lights_manual_config_char, bytes([new_colour]))
+    state.set(Slot.slot_lights_colour, new_colour)
 
 
 def btn_light_colour_hold_handler(btn):
     log.debug("Light colour button hold")
-    current_brand = UIManager.ble.lights_brand_char.read()
-    if current_brand == enums.Light.Brands.SpaElectric:
-        current_brand = enums.Light.Brands.AquaQuip
+    current_brand = state.get(Slot.slot_lights_brand)
+    if current_brand == enums.Light.Brands.SpaElectric[0]:
+        current_brand = enums.Light.Brands.AquaQuip[0]
     else:
-        current_brand = enums.Light.Brands.SpaElectric
+        current_brand = enums.Light.Brands.SpaElectric[0]
 
-    UIManager.ble.update_char(UIManager.ble.lights_brand_char, current_brand)
+    state.set(Slot.slot_lights_brand, current_brand)
 
 
 def btn_water_feature_released_handler(btn):
     log.debug("Water feature button released")
-    current_mode = UIManager.ble.wf_mode_char.read()
-    if current_mode == enums.Modes.ManualOff:
-        current_mode = enums.Modes.ManualOn
+    current_mode = state.get(Slot.slot_wf_mode)
+    if current_mode == enums.Modes.ManualOff[0]:
+        current_mode = enums.Modes.ManualOn[0]
     else:
-        current_mode = enums.Modes.ManualOff
+        current_mode = enums.Modes.ManualOff[0]
 
-    UIManager.ble.update_char(UIManager.ble.wf_mode_char, current_mode)
+    state.set(Slot.slot_wf_mode, current_mode)
 
 
 def btn_water_feature_hold_handler(btn):
     log.debug("Water feature button hold")
-    UIManager.ble.update_char(UIManager.ble.wf_mode_char, enums.Modes.Auto)
+    state.set(Slot.slot_wf_mode, enums.Modes.Auto[0])
 
 
 def btn_heat_mode_released_handler(btn):
     log.debug("Heat mode button released")
-    current_mode = UIManager.ble.heat_mode_char.read()[0]
+    current_mode = state.get(Slot.slot_heat_mode)
     new_mode = (current_mode + 1) % 3
     if current_mode == enums.HeaterModes.Automatic[0]:  # go from auto to off
         new_mode = enums.HeaterModes.Off_Filter[0]
 
-    UIManager.ble.update_char(UIManager.ble.heat_mode_char, bytes([new_mode]))
+    state.set(Slot.slot_heat_mode, new_mode)
 
 
 def btn_heat_mode_hold_handler(btn):
     log.debug("Heat mode button hold")
-    UIManager.ble.update_char(
-        UIManager.ble.heat_mode_char, enums.HeaterModes.Automatic)
+    state.set(Slot.slot_heat_mode, enums.HeaterModes.Automatic[0])
 
 
 def btn_heat_increment_released_handler(btn):
     log.debug("Heat increment button released")
     if UIManager.heat.is_enabled():
-        current_mode = UIManager.ble.heat_mode_char.read()
-        current_temp = UIManager.ble.heat_manual_config_char.read()
-        pool = current_temp[0]
-        spa = current_temp[1]
-        log.debug(f"current_temp: {current_temp[0], current_temp[1]}")
-        if current_mode == enums.HeaterModes.Pool:  # pool
-            pool += 1
-            if pool > 40:
-                pool = 40
-            log.debug(f"pool: {pool}")
-        elif current_mode == enums.HeaterModes.Spa:  # spa
-            spa += 1
-            if spa > 40:
-                spa = 40
-            log.debug(f"spa: {spa}")
-        else:
+        if not UIManager.setpoint.adjust(1):
             log.debug(
                 "Heat increment button released, but not in pool or spa mode")
-            return
-        log.debug(f"new_temp: {pool, spa}")
-
-        UIManager.ble.update_char(
-            UIManager.ble.heat_manual_config_char, bytes([pool, spa]))
     else:
         log.debug("Heat increment button released, but heater is disabled")
 
@@ -224,29 +270,9 @@ def btn_heat_increment_released_handler(btn):
 def btn_heat_decrement_released_handler(btn):
     log.debug("Heat decrement button released")
     if UIManager.heat.is_enabled():
-        current_mode = UIManager.ble.heat_mode_char.read()
-        current_temp = UIManager.ble.heat_manual_config_char.read()
-        pool = current_temp[0]
-        spa = current_temp[1]
-        log.debug(f"current_temp: {current_temp[0], current_temp[1]}")
-        if current_mode == enums.HeaterModes.Pool:  # pool
-            pool -= 1
-            if pool < 15:
-                pool = 15
-            log.debug(f"pool: {pool}")
-        elif current_mode == enums.HeaterModes.Spa:  # spa
-            spa -= 1
-            if spa < 15:
-                spa = 15
-            log.debug(f"spa: {spa}")
-        else:
+        if not UIManager.setpoint.adjust(-1):
             log.debug(
                 "Heat decrement button released, but not in pool or spa mode")
-            return
-        log.debug(f"new_temp: {pool, spa}")
-
-        UIManager.ble.update_char(
-            UIManager.ble.heat_manual_config_char, bytes([pool, spa]))
     else:
         log.debug("Heat decrement button released, but heater is disabled")
 
@@ -258,24 +284,22 @@ def btn_power_released_handler(btn):
     global count
     count = 0
     log.critical("GL toggle")
-    current_mode = UIManager.ble.gl_mode_char.read()
-    if current_mode == enums.Modes.ManualOff:
-        current_mode = enums.Modes.ManualOn
+    current_mode = state.get(Slot.slot_gl_mode)
+    if current_mode == enums.Modes.ManualOff[0]:
+        current_mode = enums.Modes.ManualOn[0]
     else:
-        current_mode = enums.Modes.ManualOff
-    UIManager.ble.update_char(UIManager.ble.gl_mode_char, current_mode)
+        current_mode = enums.Modes.ManualOff[0]
+    state.set(Slot.slot_gl_mode, current_mode)
 
 
 def btn_power_hold_handler(btn):
     global count
     if count == 0:
         log.critical("GL Auto")
-        UIManager.ble.update_char(
-            UIManager.ble.gl_mode_char, enums.Modes.Auto)
+        state.set(Slot.slot_gl_mode, enums.Modes.Auto[0])
     if count >= 3*5:  # 3 repeats per second, 5 seconds
         log.critical("spa refill")
-        UIManager.ble.update_char(
-            UIManager.ble.spa_refill_mode_char, enums.Modes.ManualOn)
+        state.set(Slot.slot_spa_refill_mode, enums.Modes.ManualOn[0])
         count = 0
     else:
         count += 1
@@ -35,8 +35,10 @@ from relay_manager import Relay  # only for type hinting
 from machine import Pin, ADC
 import uasyncio as aio
 from library.logger import Log
+from library import logring
 
 log = Log(__name__, Log.DEBUG).get_logger()
+ring_log = logring.RingLogger(logring.ring, __name__, Log.INFO)
 
 
 class Valve:
@@ -59,7 +61,7 @@ class Valve:
         # self._relay.off() # this happens in ValveManager
 
     def _start_position_B_ON(self):
-        log.debug(f"Starting position B ON...")
+        log.debug("Starting position B ON...")
         self.position = Valve.Position.transition_to_B_ON
         self._relay.on()
 
@@ -112,11 +114,14 @@ class ValveManager:
     def _adc_read(self, valve_count: int = 1):
         reading = self.adc.read()
         if valve_count == 1 and reading > self.ADCThreshold.one_VALVE_MOVING:
-            log.error(f"ADC Reading too high for 1 valve moving: {reading}")
+            log.error("ADC Reading too high for 1 valve moving: %d", reading)
+            ring_log.error("ADC high", valve_count, reading)
         elif valve_count == 2 and reading > self.ADCThreshold.two_VALVEs_MOVING:
-            log.error(f"ADC Reading too high for 2 valves moving: {reading}")
+            log.error("ADC Reading too high for 2 valves moving: %d", reading)
+            ring_log.error("ADC high", valve_count, reading)
         if reading > self.ADCThreshold.MAX:
-            log.critical(f"ADC Reading too high for valves: {reading}")
+            log.critical("ADC Reading too high for valves: %d", reading)
+            ring_log.critical("ADC max", valve_count, reading)
         return reading
 
     async def _transition_valves(self, valve_count: int = 1):
@@ -124,15 +129,17 @@ class ValveManager:
         it is the responsibility of the calling function to set valves in the correct position.
         '''
         log.debug("Master power relay ON...")
+        ring_log.info("valves moving", valve_count)
         self.STATE = ValveManager.State.TRANSITION
         self._master_power_relay.on()
         adc = self._adc_read(valve_count)
         count = 0
         while adc < self.ADCThreshold.STOPPED:
             if count > 2:
-                log.error(f"Valve(s) are not moving... [{adc}]")
+                log.error("Valve(s) are not moving... [%d]", adc)
+                ring_log.error("valves not moving", valve_count, adc)
                 break
-            log.debug(f"Waiting for valve(s) to start moving [{adc}]")
+            log.debug("Waiting for valve(s) to start moving [%d]", adc)
             await aio.sleep(1)
             adc = self._adc_read(valve_count)
             count += 1
@@ -140,9 +147,10 @@ class ValveManager:
         count = 0
         while adc > self.ADCThreshold.STOPPED:
             if count > 60:
-                log.error(f"Valve(s) are not stopping... [{adc}]")
+                log.error("Valve(s) are not stopping... [%d]", adc)
+                ring_log.error("valves not stopping", valve_count, adc)
                 break
-            log.debug(f"Waiting for valve(s) to stop moving [{adc}]")
+            log.debug("Waiting for valve(s) to stop moving [%d]", adc)
             await aio.sleep(1)
             adc = self._adc_read(valve_count)
             count += 1